@@ -2,89 +2,147 @@ from fastapi import APIRouter, Request, Response, HTTPException, status, Depends
 from fastapi.security import HTTPBasic, HTTPBasicCredentials
 from fastapi.responses import RedirectResponse
 from starlette.datastructures import URL
-from collections import deque
 from functools import wraps
+from inspect import iscoroutinefunction
 
+from credentials import create_credential_store
+from keystore import create_key_store
+from metrics import metrics
 from models import FormatEnum
-from utils import logger, check_credentials, create_login_key, format_message
+from utils import logger, check_credentials, format_message
 
 router = APIRouter(tags=['authentication'])
 security = HTTPBasic()
 
-router.session_keys = deque([], maxlen=3)
-router.token_keys = deque([], maxlen=3)
+router.session_keys = create_key_store('session')
+router.token_keys = create_key_store('token')
+router.credentials = create_credential_store()
 
 
-def session_required(func):
-    """Raises exception if request argument in decorated view function doesn't contain valid session cookie."""
+async def create_key(key_store):
+    """Return new key saved in key store - stores with blocking I/O are changed with their async method."""
+    if hasattr(key_store, 'create_async'):
+        return await key_store.create_async()
+    return key_store.create()
+
+
+async def contains_key(key_store, key: str):
+    """Return True if key is saved in key store - stores with blocking I/O are checked with their async method."""
+    if hasattr(key_store, 'contains_async'):
+        return await key_store.contains_async(key)
+    return key in key_store
+
+
+async def remove_key(key_store, key: str):
+    """Delete key from key store - stores with blocking I/O are changed with their async method."""
+    if hasattr(key_store, 'remove_async'):
+        await key_store.remove_async(key)
+    else:
+        key_store.remove(key)
+
+
+def key_required(func, argument: str, key_store):
+    """Wraps sync or async view function with validation of key passed in given argument against key store returned
+    by key_store function."""
+
+    if iscoroutinefunction(func):
+        @wraps(func)
+        async def async_wrapper(**kwargs):
+            logger.debug('key_validation', extra={'argument': argument})
+            if not await contains_key(key_store(), kwargs[argument]):
+                raise HTTPException(status.HTTP_401_UNAUTHORIZED)
+            return await func(**kwargs)
+
+        return async_wrapper
 
     @wraps(func)
-    def wrapper(session_token, **kwargs):
-        logger.info(f'Session validation {session_token=}')
-        if session_token not in router.session_keys:
+    def wrapper(**kwargs):
+        logger.debug('key_validation', extra={'argument': argument})
+        if kwargs[argument] not in key_store():
             raise HTTPException(status.HTTP_401_UNAUTHORIZED)
-        return func(session_token, **kwargs)
+        return func(**kwargs)
 
     return wrapper
 
 
+def session_required(func):
+    """Raises exception if request argument in decorated view function doesn't contain valid session cookie."""
+    return key_required(func, 'session_token', lambda: router.session_keys)
+
+
 def token_required(func):
     """Raises exception if token argument in decorated view function is invalid."""
+    return key_required(func, 'token', lambda: router.token_keys)
 
-    @wraps(func)
-    def wrapper(token, **kwargs):
-        logger.info(f'Token validation {token=}')
-        if token not in router.token_keys:
-            raise HTTPException(status.HTTP_401_UNAUTHORIZED)
-        return func(token, **kwargs)
 
-    return wrapper
+async def authenticate(credentials: HTTPBasicCredentials, kind: str):
+    """Raises exception if given credentials are invalid and counts login attempt result."""
+    try:
+        await check_credentials(credentials, router.credentials)
+    except HTTPException:
+        metrics.inc('login_attempts_total', kind=kind, result='failure')
+        raise
+    metrics.inc('login_attempts_total', kind=kind, result='success')
+
+
+def key_store_metrics():
+    """Yield session cache size and counters of in-memory key stores in Prometheus text format."""
+    key_stores = [(kind, key_store.stats()) for kind, key_store
+                  in [('session', router.session_keys), ('token', router.token_keys)] if hasattr(key_store, 'stats')]
+    for name, metric_type in [('size', 'gauge'), ('hits', 'counter'), ('misses', 'counter'),
+                              ('evictions', 'counter'), ('expirations', 'counter')]:
+        metric = f'session_cache_{name}' if metric_type == 'gauge' else f'session_cache_{name}_total'
+        yield f'# TYPE {metric} {metric_type}'
+        for kind, stats in key_stores:
+            yield f'{metric}{{kind="{kind}"}} {stats[name]}'
+
+
+metrics.collectors.append(key_store_metrics)
 
 
 @router.post('/login_session')
-def login_session(credentials: HTTPBasicCredentials = Depends(security)):
+async def login_session(credentials: HTTPBasicCredentials = Depends(security)):
     """Create session if given credentials are valid."""
-    logger.info(f'Login request with {credentials=}')
-    check_credentials(credentials)
+    logger.info('login_request', extra={'username': credentials.username})
+    await authenticate(credentials, 'session')
     response = Response(status_code=status.HTTP_201_CREATED)
-    session = create_login_key()
+    session = await create_key(router.session_keys)
     response.set_cookie('session_token', session)
-    router.session_keys.append(session)
     return response
 
 
 @router.post('/login_token', status_code=status.HTTP_201_CREATED)
-def login_token(credentials: HTTPBasicCredentials = Depends(security)):
+async def login_token(credentials: HTTPBasicCredentials = Depends(security)):
     """Return token if given credentials are valid."""
-    logger.info(f'Login request with {credentials=}')
-    check_credentials(credentials)
-    token = create_login_key()
-    router.token_keys.append(token)
+    logger.info('login_request', extra={'username': credentials.username})
+    await authenticate(credentials, 'token')
+    token = await create_key(router.token_keys)
     return {'token': token}
 
 
 @router.get('/welcome_session')
 @session_required
-def welcome_session(session_token: str = Cookie(''),
-                    message_format: FormatEnum = Query(FormatEnum.txt, alias='format')):
+async def welcome_session(session_token: str = Cookie(''),
+                          message_format: FormatEnum = Query(FormatEnum.txt, alias='format'), request: Request = ...):
     """Return welcome message to user based on given response format. Endpoint only available to users with valid
     session cookie - request argument is used in decorator."""
 
-    return format_message('Welcome!', message_format)
+    return format_message('Welcome!', message_format, request)
 
 
 @router.get('/welcome_token')
 @token_required
-def welcome_token(token: str = '', message_format: FormatEnum = Query(FormatEnum.txt, alias='format')):
+async def welcome_token(token: str = '', message_format: FormatEnum = Query(FormatEnum.txt, alias='format'),
+                        request: Request = ...):
     """Return welcome message to user based on given response format. Endpoint only available to users with valid token
      - token argument is used in decorator."""
 
-    return format_message('Welcome!', message_format)
+    return format_message('Welcome!', message_format, request)
 
 
 @router.delete('/logout_session')
 @session_required
-def logout_session(session_token: str = Cookie(''), request: Request = ...):
+async def logout_session(session_token: str = Cookie(''), request: Request = ...):
     """Logs out user by removing cookie session. Endpoint only available to users with valid session cookie - request
     argument is used also in decorator."""
     redirect_path = '/logged_out'
@@ -93,14 +151,14 @@ def logout_session(session_token: str = Cookie(''), request: Request = ...):
     response = RedirectResponse(URL(redirect_path), status_code=status.HTTP_303_SEE_OTHER)
     session = request.cookies['session_token']
     response.delete_cookie('session_token')
-    router.session_keys.remove(session)
+    await remove_key(router.session_keys, session)
 
     return response
 
 
 @router.delete('/logout_token')
 @token_required
-def logout_session(token: str = '', message_format: FormatEnum = Query(FormatEnum.txt, alias='format')):
+async def logout_session(token: str = '', message_format: FormatEnum = Query(FormatEnum.txt, alias='format')):
     """Logs out user by removing token session. Endpoint only available to users with valid token - token argument
     is used in decorator."""
     redirect_path = '/logged_out'
@@ -108,12 +166,12 @@ def logout_session(token: str = '', message_format: FormatEnum = Query(FormatEnu
         redirect_path += f'?format={message_format}'
     response = RedirectResponse(URL(redirect_path), status_code=status.HTTP_303_SEE_OTHER)
     response.delete_cookie('session_token')
-    router.token_keys.remove(token)
+    await remove_key(router.token_keys, token)
 
     return response
 
 
 @router.get('/logged_out')
-def logout(message_format: FormatEnum = Query(FormatEnum.txt, alias='format')):
+async def logout(message_format: FormatEnum = Query(FormatEnum.txt, alias='format'), request: Request = ...):
     """Return message to user after log out."""
-    return format_message('Logged out!', message_format)
+    return format_message('Logged out!', message_format, request, 'public, max-age=86400')
@@ -0,0 +1,33 @@
+"""In-process HTTP client for ASGI applications used by benchmarks."""
+from asyncio import Event
+from urllib.parse import urlencode
+
+
+async def call(app, method: str, path: str, params: dict = None, headers: dict = None, body: bytes = b''):
+    """Send single request to ASGI application and return (status, headers, body) tuple."""
+    scope = {'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': method, 'scheme': 'http',
+             'path': path, 'raw_path': path.encode(), 'root_path': '',
+             'query_string': urlencode(params or {}).encode(),
+             'headers': [(name.lower().encode(), value.encode()) for name, value in (headers or {}).items()],
+             'client': ('127.0.0.1', 50000), 'server': ('testserver', 80)}
+    request_sent, response_complete = False, Event()
+    response = {'status': None, 'headers': [], 'body': []}
+
+    async def receive():
+        nonlocal request_sent
+        if not request_sent:
+            request_sent = True
+            return {'type': 'http.request', 'body': body, 'more_body': False}
+        await response_complete.wait()
+        return {'type': 'http.disconnect'}
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            response['status'], response['headers'] = message['status'], message.get('headers', [])
+        elif message['type'] == 'http.response.body':
+            response['body'].append(message.get('body', b''))
+            if not message.get('more_body', False):
+                response_complete.set()
+
+    await app(scope, receive, send)
+    return response['status'], dict(response['headers']), b''.join(response['body'])
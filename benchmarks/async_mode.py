@@ -0,0 +1,71 @@
+"""Side by side throughput and latency of token protected welcome endpoint served by sync and async view functions.
+
+Run from repository root:
+    $ python -m benchmarks.async_mode --clients 64 --requests 200
+"""
+from argparse import ArgumentParser
+from asyncio import gather, get_event_loop
+from statistics import quantiles
+from time import perf_counter
+
+from fastapi import FastAPI, Request
+
+from auth import router, token_required
+from benchmarks.asgi import call
+from models import FormatEnum
+from utils import logger, format_message
+
+
+def create_apps():
+    """Return (sync_app, async_app) pair serving the same token protected '/welcome_token' endpoint."""
+    sync_app, async_app = FastAPI(), FastAPI()
+
+    @sync_app.get('/welcome_token')
+    @token_required
+    def welcome_sync(token: str = '', request: Request = ...):
+        return format_message('Welcome!', FormatEnum.txt, request)
+
+    @async_app.get('/welcome_token')
+    @token_required
+    async def welcome_async(token: str = '', request: Request = ...):
+        return format_message('Welcome!', FormatEnum.txt, request)
+
+    return sync_app, async_app
+
+
+async def client(app, token: str, requests: int, latencies: list):
+    """Send requests one after another and save their latencies."""
+    for _ in range(requests):
+        start = perf_counter()
+        status, _, _ = await call(app, 'GET', '/welcome_token', {'token': token})
+        latencies.append(perf_counter() - start)
+        assert status == 200, status
+
+
+async def measure(app, token: str, clients: int, requests: int):
+    """Return (throughput, p50, p99) of app under load of concurrent clients."""
+    latencies = []
+    start = perf_counter()
+    await gather(*(client(app, token, requests, latencies) for _ in range(clients)))
+    elapsed = perf_counter() - start
+    percentiles = quantiles(latencies, n=100)
+    return len(latencies) / elapsed, percentiles[49] * 1000, percentiles[98] * 1000
+
+
+def run():
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument('--clients', type=int, default=64)
+    parser.add_argument('--requests', type=int, default=200)
+    args = parser.parse_args()
+
+    logger.disabled = True
+    token = router.token_keys.create()
+    loop = get_event_loop()
+    for mode, app in zip(['sync', 'async'], create_apps()):
+        loop.run_until_complete(measure(app, token, args.clients, 10))
+        throughput, p50, p99 = loop.run_until_complete(measure(app, token, args.clients, args.requests))
+        print(f'{mode:>5}: {throughput:,.0f} req/s, p50 {p50:.2f} ms, p99 {p99:.2f} ms')
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,90 @@
+"""Cold start of the application - time from starting Uvicorn process to first response of '/' endpoint and latency of
+the first and second '/openapi.json' requests (schema used by '/docs' and '/redoc'). Application is measured with
+OpenAPI schema generated on demand and prebuilt with openapi.py script. With --imports also modules with the longest
+import time are listed (from 'python -X importtime').
+
+Run from repository root:
+    $ python -m benchmarks.cold_start --runs 5 --imports 15
+"""
+from argparse import ArgumentParser
+from http.client import HTTPConnection
+from os import environ
+from statistics import median
+from subprocess import DEVNULL, PIPE, Popen, run as run_process
+from sys import executable
+from tempfile import TemporaryDirectory
+from time import perf_counter, sleep
+
+ENVIRONMENT = {**environ, 'PATIENT_STORAGE': 'memory', 'USER_LOGIN': 'admin', 'USER_PASSWORD': 'admin'}
+
+
+def timed_request(port: int, path: str):
+    """Return seconds to receive response of GET request sent on new connection."""
+    start = perf_counter()
+    connection = HTTPConnection('127.0.0.1', port)
+    connection.request('GET', path)
+    response = connection.getresponse()
+    response.read()
+    connection.close()
+    assert response.status == 200, (path, response.status)
+    return perf_counter() - start
+
+
+def measure(port: int, environment: dict):
+    """Start Uvicorn and return (seconds to first response, first and second '/openapi.json' latency)."""
+    start = perf_counter()
+    server = Popen([executable, '-m', 'uvicorn', 'main:app', '--port', str(port), '--no-access-log',
+                    '--log-level', 'warning'], env=environment, stdout=DEVNULL, stderr=DEVNULL)
+    try:
+        while True:
+            try:
+                timed_request(port, '/')
+                break
+            except OSError:
+                if server.poll() is not None:
+                    raise RuntimeError('Server did not start')
+                sleep(0.005)
+        first_response = perf_counter() - start
+        return first_response, timed_request(port, '/openapi.json'), timed_request(port, '/openapi.json')
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def import_times(count: int):
+    """Return list of (module, cumulative microseconds) of application modules importing the longest."""
+    result = run_process([executable, '-X', 'importtime', '-c', 'import main'], env=ENVIRONMENT, stdout=DEVNULL,
+                         stderr=PIPE, universal_newlines=True)
+    times = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        _, cumulative, module = line[len('import time:'):].split('|')
+        if cumulative.strip().isdigit():
+            times.append((module.strip(), int(cumulative)))
+    return sorted(times, key=lambda item: item[1], reverse=True)[:count]
+
+
+def run():
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--imports', type=int, default=0, help='number of the slowest imported modules to list')
+    args = parser.parse_args()
+
+    if args.imports:
+        for module, microseconds in import_times(args.imports):
+            print(f'{module:<40}{microseconds / 1000:>8.1f} ms')
+    with TemporaryDirectory() as directory:
+        schema_path = f'{directory}/openapi.json'
+        run_process([executable, 'openapi.py', schema_path], env=ENVIRONMENT, check=True)
+        for mode, environment in [('generated schema', ENVIRONMENT),
+                                  ('prebuilt schema', {**ENVIRONMENT, 'OPENAPI_FILE': schema_path})]:
+            results = [measure(args.port, environment) for _ in range(args.runs)]
+            first_response, first_schema, second_schema = (median(values) * 1000 for values in zip(*results))
+            print(f'{mode}: time to first response {first_response:.0f} ms, /openapi.json first {first_schema:.1f} '
+                  f'ms, second {second_schema:.1f} ms (median of {args.runs} runs)')
+
+
+if __name__ == '__main__':
+    run()
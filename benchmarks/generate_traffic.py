@@ -0,0 +1,58 @@
+"""Generator of synthetic traffic files replayed by benchmarks.replay.
+
+Every line is JSON request with method, path and optional params, json, auth, cookies and headers. Values '{token}'
+and '{session}' are replaced by the last received login keys and '{patient_id}' by id of random registered patient.
+
+Run from repository root:
+    $ python -m benchmarks.generate_traffic --requests 1000000 --output traffic.jsonl
+"""
+from argparse import ArgumentParser
+from json import dumps
+from random import Random
+
+NAMES = ['Jan', 'Anna', 'Piotr', 'Maria', 'Krzysztof', 'Katarzyna', 'Andrzej', 'Małgorzata', 'Tomasz', 'Agnieszka']
+SURNAMES = ['Nowak', 'Kowalski', 'Wiśniewski', 'Wójcik', 'Kowalczyk', 'Kamiński', 'Lewandowski', 'Zieliński']
+CREDENTIALS = ['admin', 'admin']
+
+MIX = [
+    (20, lambda random: {'method': 'POST', 'path': '/register',
+                         'json': {'name': random.choice(NAMES), 'surname': random.choice(SURNAMES)}}),
+    (30, lambda random: {'method': 'GET', 'path': '/patient/{patient_id}'}),
+    (5, lambda random: {'method': 'POST', 'path': '/login_token', 'auth': CREDENTIALS}),
+    (3, lambda random: {'method': 'POST', 'path': '/login_session', 'auth': CREDENTIALS}),
+    (20, lambda random: {'method': 'GET', 'path': '/welcome_token',
+                         'params': {'token': '{token}', 'format': random.choice(['txt', 'html', 'json'])}}),
+    (10, lambda random: {'method': 'GET', 'path': '/welcome_session', 'cookies': {'session_token': '{session}'}}),
+    (2, lambda random: {'method': 'DELETE', 'path': '/logout_token', 'params': {'token': '{token}'}}),
+    (1, lambda random: {'method': 'DELETE', 'path': '/logout_session', 'cookies': {'session_token': '{session}'}}),
+    (5, lambda random: {'method': 'GET', 'path': '/logged_out'}),
+    (4, lambda random: {'method': 'GET', 'path': '/hello'}),
+]
+
+
+def generate(requests: int, seed: int = 0):
+    """Yield given number of requests drawn from traffic mix - starting with logins and first registration."""
+    random = Random(seed)
+    weights = [weight for weight, _ in MIX]
+    factories = [factory for _, factory in MIX]
+    yield {'method': 'POST', 'path': '/login_token', 'auth': CREDENTIALS}
+    yield {'method': 'POST', 'path': '/login_session', 'auth': CREDENTIALS}
+    yield MIX[0][1](random)
+    for _ in range(requests - 3):
+        yield random.choices(factories, weights)[0](random)
+
+
+def run():
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument('--requests', type=int, default=1_000_000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='traffic.jsonl')
+    args = parser.parse_args()
+
+    with open(args.output, 'w', encoding='utf-8') as file:
+        for request in generate(args.requests, args.seed):
+            file.write(dumps(request, ensure_ascii=False) + '\n')
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,38 @@
+"""Password verifications per second with growing number of process pool workers.
+
+Run from repository root:
+    $ python -m benchmarks.hashing --algorithm pbkdf2_sha256 --pairs 256
+"""
+from argparse import ArgumentParser
+from asyncio import get_event_loop
+from os import cpu_count
+from time import perf_counter
+
+from hashing import PasswordHasher, hash_password
+
+
+def run():
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument('--algorithm', choices=['pbkdf2_sha256', 'scrypt'], default='pbkdf2_sha256')
+    parser.add_argument('--pairs', type=int, default=256)
+    parser.add_argument('--max-workers', type=int, default=cpu_count())
+    args = parser.parse_args()
+
+    password_hash = hash_password('password', args.algorithm)
+    pairs = [('password', password_hash)] * args.pairs
+    loop = get_event_loop()
+    baseline = None
+    for workers in range(1, args.max_workers + 1):
+        hasher = PasswordHasher(workers, max_pending=args.pairs)
+        loop.run_until_complete(hasher.verify_many(pairs[:workers]))
+        start = perf_counter()
+        results = loop.run_until_complete(hasher.verify_many(pairs))
+        throughput = len(pairs) / (perf_counter() - start)
+        hasher.shutdown()
+        assert all(results)
+        baseline = baseline or throughput
+        print(f'{workers} workers: {throughput:,.1f} verifications/s ({throughput / baseline:.2f}x)')
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,89 @@
+"""Memory used by patient records - list of Patient objects compared with compact table of MemoryStorage.
+
+Patient objects take several hundred bytes each, so their memory is measured on --object-sample records and
+extrapolated linearly to all records. Names and surnames are drawn from pools of --names distinct values shared by
+both representations.
+
+Run from repository root:
+    $ python -m benchmarks.memory --patients 10000000
+"""
+from argparse import ArgumentParser
+from datetime import date
+from random import choice, randint, seed
+from time import perf_counter
+from tracemalloc import get_traced_memory, start, stop
+
+from models import Patient
+from storage import MemoryStorage
+
+
+def generate(count: int, names: list, surnames: list):
+    """Yield patients with random names and dates."""
+    today = date.today().toordinal()
+    for patient_id in range(1, count + 1):
+        yield Patient.construct(name=choice(names), surname=choice(surnames), id=patient_id,
+                                register_date=date.fromordinal(today),
+                                vaccination_date=date.fromordinal(today + randint(1, 60)))
+
+
+def measure(build):
+    """Return object returned by build function and number of bytes it allocated."""
+    start()
+    try:
+        result = build()
+        return result, get_traced_memory()[0]
+    finally:
+        stop()
+
+
+def build_table(patients):
+    """Return storage filled with patients in chunks, as batch registration does."""
+    storage = MemoryStorage()
+    chunk = []
+    for patient in patients:
+        chunk.append(patient)
+        if len(chunk) == 10000:
+            storage.extend(chunk)
+            chunk = []
+    storage.extend(chunk)
+    return storage
+
+
+def run():
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument('--patients', type=int, default=10000000)
+    parser.add_argument('--object-sample', type=int, default=1000000)
+    parser.add_argument('--names', type=int, default=5000)
+    args = parser.parse_args()
+
+    seed(0)
+    names = [f'Name{number}' for number in range(args.names)]
+    surnames = [f'Surname{number}' for number in range(args.names)]
+    sample = min(args.object_sample, args.patients)
+
+    objects, objects_memory = measure(lambda: list(generate(sample, names, surnames)))
+    objects_per_patient = objects_memory / sample
+    del objects
+
+    started = perf_counter()
+    table, table_memory = measure(lambda: build_table(generate(args.patients, names, surnames)))
+    elapsed = perf_counter() - started
+    table_per_patient = table_memory / args.patients
+
+    started = perf_counter()
+    for patient_id in range(1, len(table) + 1, max(len(table) // 100000, 1)):
+        table.get(patient_id)
+    lookups = len(range(1, len(table) + 1, max(len(table) // 100000, 1)))
+    lookup_time = (perf_counter() - started) / lookups
+
+    print(f'patients: {args.patients:,} ({args.names:,} distinct names and surnames)')
+    print(f'Patient objects: {objects_per_patient:,.0f} B/patient, '
+          f'{objects_per_patient * args.patients / 2 ** 20:,.0f} MiB (measured on {sample:,})')
+    print(f'compact table: {table_per_patient:,.1f} B/patient, {table_memory / 2 ** 20:,.0f} MiB '
+          f'(filled in {elapsed:.1f} s)')
+    print(f'reduction: {objects_per_patient / table_per_patient:.1f}x, '
+          f'get(): {lookup_time * 1e6:.2f} us/patient')
+
+
+if __name__ == '__main__':
+    run()
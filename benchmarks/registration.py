@@ -0,0 +1,57 @@
+"""Stress test of '/register' endpoint - concurrent clients register patients in-process and all returned and saved
+ids are checked to be unique and contiguous.
+
+Run from repository root:
+    $ python -m benchmarks.registration --clients 256 --requests 100
+"""
+from argparse import ArgumentParser
+from asyncio import gather, get_event_loop
+from json import dumps, loads
+from os import environ
+from sys import exit
+from time import perf_counter
+
+environ.setdefault('PATIENT_STORAGE', 'memory')
+
+from benchmarks.asgi import call
+from main import app
+
+
+async def client(requests: int, ids: list):
+    """Register patients one after another and save returned ids."""
+    body = dumps({'name': 'Jan', 'surname': 'Nowak'}).encode()
+    for _ in range(requests):
+        status, _, response_body = await call(app, 'POST', '/register', headers={'content-type': 'application/json'},
+                                              body=body)
+        assert status == 201, status
+        ids.append(loads(response_body)['id'])
+
+
+async def stress(clients: int, requests: int):
+    """Run concurrent clients and return returned ids and elapsed time."""
+    ids = []
+    start = perf_counter()
+    await gather(*(client(requests, ids) for _ in range(clients)))
+    return ids, perf_counter() - start
+
+
+def run():
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument('--clients', type=int, default=256)
+    parser.add_argument('--requests', type=int, default=100, help='registrations sent by every client')
+    args = parser.parse_args()
+
+    first_id = len(app.patients) + 1
+    ids, elapsed = get_event_loop().run_until_complete(stress(args.clients, args.requests))
+    expected = list(range(first_id, first_id + len(ids)))
+    saved = [patient.id for patient in app.patients.scan(first_id - 1)]
+
+    print(f'{args.clients} clients, {len(ids):,} registrations: {len(ids) / elapsed:,.0f} registrations/s')
+    print(f'duplicate returned ids: {len(ids) - len(set(ids))}, saved records: {len(saved):,}')
+    if sorted(ids) != expected or saved != expected:
+        print('FAILED: returned or saved ids are not unique and contiguous')
+        exit(1)
+
+
+if __name__ == '__main__':
+    run()
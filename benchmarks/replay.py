@@ -0,0 +1,163 @@
+"""Load test replaying recorded traffic mix against the application in-process.
+
+Requests are read lazily from traffic file (see benchmarks.generate_traffic) and sent by concurrent clients directly
+to ASGI application. Throughput and p50/p95/p99 latency are reported per route. Results can be saved as baseline and
+later runs fail when throughput drops or p95 latency grows more than given tolerance.
+
+Run from repository root:
+    $ python -m benchmarks.replay --traffic benchmarks/traffic.jsonl --concurrency 32 --save-baseline baseline.json
+    $ python -m benchmarks.replay --traffic benchmarks/traffic.jsonl --concurrency 32 --baseline baseline.json
+"""
+from argparse import ArgumentParser
+from asyncio import gather, get_event_loop
+from base64 import b64encode
+from collections import defaultdict
+from itertools import islice
+from json import dump, dumps, load, loads
+from os import environ
+from random import randint
+from statistics import quantiles
+from sys import exit
+from time import perf_counter
+
+environ.setdefault('PATIENT_STORAGE', 'memory')
+environ.setdefault('USER_LOGIN', 'admin')
+environ.setdefault('USER_PASSWORD', 'admin')
+
+from starlette.routing import Match
+
+from benchmarks.asgi import call
+from main import app
+
+
+class Replay:
+    """Replays requests against application and collects latencies and status classes per route."""
+
+    def __init__(self, application):
+        self.app = application
+        self.keys = {'token': '', 'session': ''}
+        self.templates = {}
+        self.latencies = defaultdict(list)
+        self.statuses = defaultdict(lambda: defaultdict(int))
+
+    def route(self, method: str, raw_path: str, path: str):
+        """Return route template (e.g. 'GET /patient/{id}') matching given request path."""
+        template = self.templates.get((method, raw_path))
+        if template is None:
+            scope = {'type': 'http', 'method': method, 'path': path}
+            matches = [route.path for route in self.app.router.routes if route.matches(scope)[0] == Match.FULL]
+            template = self.templates[method, raw_path] = f'{method} {matches[0] if matches else path}'
+        return template
+
+    def substitute(self, value: str):
+        """Return value with login keys and patient id placeholders replaced."""
+        if '{' not in value:
+            return value
+        patient_id = randint(1, max(len(self.app.patients), 1))
+        return value.format(patient_id=patient_id, **self.keys)
+
+    async def send(self, request: dict):
+        """Send single recorded request, save its latency and login keys from response."""
+        method, raw_path = request['method'], request['path']
+        path = self.substitute(raw_path)
+        params = {name: self.substitute(value) for name, value in request.get('params', {}).items()}
+        headers = {name: self.substitute(value) for name, value in request.get('headers', {}).items()}
+        body = b''
+        if 'json' in request:
+            body = dumps(request['json']).encode()
+            headers['content-type'] = 'application/json'
+        if 'auth' in request:
+            headers['authorization'] = 'Basic ' + b64encode(':'.join(request['auth']).encode()).decode()
+        if 'cookies' in request:
+            headers['cookie'] = '; '.join(f'{name}={self.substitute(value)}'
+                                          for name, value in request['cookies'].items())
+
+        start = perf_counter()
+        status, response_headers, response_body = await call(self.app, method, path, params, headers, body)
+        elapsed = perf_counter() - start
+
+        route = self.route(method, raw_path, path)
+        self.latencies[route].append(elapsed)
+        self.statuses[route][f'{status // 100}xx'] += 1
+        if path == '/login_token' and status == 201:
+            self.keys['token'] = loads(response_body)['token']
+        elif path == '/login_session' and status == 201:
+            self.keys['session'] = response_headers[b'set-cookie'].decode().split(';')[0].split('=', 1)[1]
+
+    async def client(self, requests):
+        """Send requests from shared iterator one after another."""
+        for request in requests:
+            await self.send(request)
+
+    async def run(self, requests, concurrency: int):
+        """Replay requests with given number of concurrent clients and return elapsed time."""
+        start = perf_counter()
+        await gather(*(self.client(requests) for _ in range(concurrency)))
+        return perf_counter() - start
+
+    def report(self, elapsed: float):
+        """Return results summary with total throughput and throughput, latency percentiles (ms) and status classes
+        per route."""
+        routes = {}
+        for route, latencies in sorted(self.latencies.items()):
+            percentiles = quantiles(latencies, n=100) if len(latencies) > 1 else latencies * 99
+            routes[route] = {'count': len(latencies), 'throughput': len(latencies) / elapsed,
+                             'p50': percentiles[49] * 1000, 'p95': percentiles[94] * 1000,
+                             'p99': percentiles[98] * 1000, 'statuses': dict(self.statuses[route])}
+        total = sum(route['count'] for route in routes.values())
+        return {'requests': total, 'throughput': total / elapsed, 'routes': routes}
+
+
+def print_report(report: dict):
+    """Print results table."""
+    print(f'{"route":<28}{"count":>9}{"req/s":>10}{"p50 ms":>9}{"p95 ms":>9}{"p99 ms":>9}  statuses')
+    for route, result in report['routes'].items():
+        statuses = ' '.join(f'{status}:{count}' for status, count in sorted(result['statuses'].items()))
+        print(f'{route:<28}{result["count"]:>9}{result["throughput"]:>10,.0f}{result["p50"]:>9.3f}'
+              f'{result["p95"]:>9.3f}{result["p99"]:>9.3f}  {statuses}')
+    print(f'total: {report["requests"]} requests, {report["throughput"]:,.0f} req/s')
+
+
+def compare(report: dict, baseline: dict, tolerance: float):
+    """Return list of regressions - throughput drop or p95 latency growth above tolerance."""
+    regressions = []
+    if report['throughput'] < baseline['throughput'] * (1 - tolerance):
+        regressions.append(f'total throughput {report["throughput"]:,.0f} < {baseline["throughput"]:,.0f} req/s')
+    for route, result in report['routes'].items():
+        expected = baseline['routes'].get(route)
+        if expected and result['p95'] > expected['p95'] * (1 + tolerance):
+            regressions.append(f'{route} p95 {result["p95"]:.3f} > {expected["p95"]:.3f} ms')
+    return regressions
+
+
+def run():
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument('--traffic', default='benchmarks/traffic.jsonl')
+    parser.add_argument('--requests', type=int, default=None, help='replay only given number of first requests')
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--baseline', help='fail if results regressed against baseline file')
+    parser.add_argument('--save-baseline', help='save results as baseline file')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    args = parser.parse_args()
+
+    replay = Replay(app)
+    with open(args.traffic, encoding='utf-8') as file:
+        requests = (loads(line) for line in islice(file, args.requests) if line.strip())
+        elapsed = get_event_loop().run_until_complete(replay.run(requests, args.concurrency))
+    report = replay.report(elapsed)
+    print_report(report)
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as file:
+            dump(report, file, indent=2)
+    if args.baseline:
+        with open(args.baseline) as file:
+            regressions = compare(report, load(file), args.tolerance)
+        for regression in regressions:
+            print(f'REGRESSION: {regression}')
+        if regressions:
+            exit(1)
+
+
+if __name__ == '__main__':
+    run()
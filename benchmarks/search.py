@@ -0,0 +1,71 @@
+"""Patient search benchmark - latency of '/patients' handler for exact, prefix and date range queries on the first and
+deep pages.
+
+Run from repository root:
+    $ python -m benchmarks.search --records 1000000
+"""
+from argparse import ArgumentParser
+from datetime import date, timedelta
+from os import environ
+from random import Random
+from statistics import median
+from time import perf_counter
+
+environ.setdefault('PATIENT_STORAGE', 'memory')
+
+import main
+from models import Patient
+
+NAMES = ['Jan', 'Anna', 'Piotr', 'Maria', 'Krzysztof', 'Katarzyna', 'Andrzej', 'Małgorzata', 'Tomasz', 'Agnieszka']
+LETTERS = 'abcdefghijklmnoprstuwyz'
+
+
+def fill(records: int):
+    """Save patients with random surnames and dates directly to storage, indexes and statistics."""
+    random = Random(0)
+    today = date.today()
+    patients = [Patient.construct(name=random.choice(NAMES), id=patient_id,
+                                  surname=''.join(random.choice(LETTERS) for _ in range(7)).capitalize(),
+                                  register_date=today - timedelta(days=random.randrange(365)),
+                                  vaccination_date=today + timedelta(days=random.randrange(365)))
+                for patient_id in range(1, records + 1)]
+    main.app.patients.extend(patients)
+    main.app.index.extend(patients)
+    main.app.stats.extend(patients)
+
+
+def measure(params: dict, samples: int):
+    """Return median latency in milliseconds of search handler called with given parameters."""
+    latencies = []
+    for _ in range(samples):
+        start = perf_counter()
+        main.search_patients(**{'surname': None, 'name': None, 'prefix': False, 'vaccination_from': None,
+                                'vaccination_to': None, 'register_from': None, 'register_to': None, 'after_id': 0,
+                                'limit': 50, **params})
+        latencies.append((perf_counter() - start) * 1000)
+    return median(latencies)
+
+
+def run():
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument('--records', type=int, default=1_000_000)
+    parser.add_argument('--samples', type=int, default=20)
+    args = parser.parse_args()
+
+    fill(args.records)
+    today, deep = date.today(), args.records - args.records // 100
+    queries = {'name': {'name': 'jan'},
+               'name, deep page': {'name': 'jan', 'after_id': deep},
+               'surname prefix (1 letter)': {'surname': 'k', 'prefix': True},
+               'surname prefix (3 letters)': {'surname': 'kot', 'prefix': True},
+               'vaccination date range': {'vaccination_from': today, 'vaccination_to': today + timedelta(days=30)},
+               'vaccination date range, deep page': {'vaccination_from': today,
+                                                     'vaccination_to': today + timedelta(days=30), 'after_id': deep},
+               'name and register date range': {'name': 'anna', 'register_from': today - timedelta(days=7)}}
+    print(f'{args.records:,} records, median of {args.samples} searches (limit 50)')
+    for label, params in queries.items():
+        print(f'{label:<36}{measure(params, args.samples):>8.3f} ms')
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,75 @@
+"""Patient storage benchmark - registration throughput and patient lookup latency.
+
+Run from repository root:
+    $ python -m benchmarks.storage --records 10000000 --backend sqlite
+"""
+from argparse import ArgumentParser
+from asyncio import get_event_loop
+from datetime import date
+from os import environ
+from random import randint
+from statistics import quantiles
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+environ.setdefault('PATIENT_STORAGE', 'memory')
+
+from fastapi import Response
+
+import main
+from models import Patient
+from pipeline import RegistrationPipeline
+from storage import MemoryStorage, SQLiteStorage
+
+
+async def register(records: int):
+    """Register patients one by one with main.register_patient handler and return registrations per second."""
+    payload = main.UnregisteredPatient(name='Jan', surname='Nowak')
+    start = perf_counter()
+    for _ in range(records):
+        await main.register_patient(payload, Response())
+    return records / (perf_counter() - start)
+
+
+def lookup(records: int, samples: int):
+    """Read random patients with main.get_patient handler and return latency percentiles in microseconds."""
+    latencies = []
+    for _ in range(samples):
+        patient_id = randint(1, records)
+        start = perf_counter()
+        patient = main.get_patient(patient_id)
+        latencies.append((perf_counter() - start) * 1e6)
+        assert isinstance(patient, Patient)
+    percentiles = quantiles(latencies, n=100)
+    return percentiles[49], percentiles[98]
+
+
+def run():
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument('--records', type=int, default=10_000_000)
+    parser.add_argument('--samples', type=int, default=10_000)
+    parser.add_argument('--backend', choices=['memory', 'sqlite'], default='sqlite')
+    args = parser.parse_args()
+
+    with TemporaryDirectory() as directory:
+        main.app.patients.close()
+        if args.backend == 'sqlite':
+            main.app.patients = SQLiteStorage(f'{directory}/patients.db')
+        else:
+            main.app.patients = MemoryStorage()
+        main.app.pipeline = RegistrationPipeline(main.app.patients, main.app.index, main.app.stats)
+        main.logger.disabled = True
+
+        throughput = get_event_loop().run_until_complete(register(args.records))
+        if args.backend == 'sqlite':
+            main.app.patients.flush()
+        p50, p99 = lookup(args.records, args.samples)
+        main.app.patients.close()
+
+    print(f'{args.backend} storage, {args.records} records, {date.today()}')
+    print(f'registration: {throughput:,.0f} patients/s')
+    print(f'GET /patient/{{id}} handler: p50 {p50:.1f}us, p99 {p99:.1f}us')
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,99 @@
+"""Throughput of '/welcome_token' endpoint served by Uvicorn with growing number of workers sharing SQLite key store.
+
+Run from repository root:
+    $ python -m benchmarks.workers --max-workers 8 --duration 10
+"""
+from argparse import ArgumentParser
+from base64 import b64encode
+from http.client import HTTPConnection
+from json import loads
+from os import cpu_count, environ
+from socket import IPPROTO_TCP, TCP_NODELAY
+from subprocess import Popen, DEVNULL
+from tempfile import TemporaryDirectory
+from threading import Thread
+from time import monotonic, sleep
+
+PORT = 8000
+
+
+def connect():
+    """Return connection to benchmarked server with Nagle's algorithm disabled."""
+    connection = HTTPConnection('127.0.0.1', PORT)
+    connection.connect()
+    connection.sock.setsockopt(IPPROTO_TCP, TCP_NODELAY, 1)
+    return connection
+
+
+def request(connection: HTTPConnection, method: str, path: str, headers: dict = None):
+    """Send request on kept alive connection and return (status, body)."""
+    connection.request(method, path, headers=headers or {})
+    response = connection.getresponse()
+    return response.status, response.read()
+
+
+def wait_for_server():
+    """Poll server until it responds."""
+    for _ in range(200):
+        try:
+            request(connect(), 'GET', '/')
+            return
+        except OSError:
+            sleep(0.05)
+    raise RuntimeError('Server did not start')
+
+
+def hammer(token: str, deadline: float, results: list):
+    """Call '/welcome_token' until deadline and append number of successful responses to results."""
+    connection, count = connect(), 0
+    while monotonic() < deadline:
+        status, _ = request(connection, 'GET', f'/welcome_token?token={token}')
+        assert status == 200, status
+        count += 1
+    results.append(count)
+
+
+def measure(workers: int, clients: int, duration: float, directory: str):
+    """Start Uvicorn with given number of workers and return '/welcome_token' requests per second."""
+    env = {**environ, 'KEY_STORE': 'sqlite', 'KEY_STORE_PATH': f'{directory}/keys.db',
+           'PATIENT_STORAGE': 'memory', 'USER_LOGIN': 'admin', 'USER_PASSWORD': 'admin'}
+    server = Popen(['uvicorn', 'main:app', '--port', str(PORT), '--workers', str(workers), '--no-access-log',
+                    '--log-level', 'warning'], env=env, stdout=DEVNULL, stderr=DEVNULL)
+    try:
+        wait_for_server()
+        credentials = b64encode(b'admin:admin').decode()
+        _, body = request(connect(), 'POST', '/login_token',
+                          {'Authorization': f'Basic {credentials}'})
+        token = loads(body)['token']
+        deadline, results = monotonic() + duration, []
+        threads = [Thread(target=hammer, args=(token, deadline, results)) for _ in range(clients)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return sum(results) / duration
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def run():
+    global PORT
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument('--max-workers', type=int, default=cpu_count())
+    parser.add_argument('--clients', type=int, default=32)
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--port', type=int, default=PORT)
+    args = parser.parse_args()
+    PORT = args.port
+
+    with TemporaryDirectory() as directory:
+        baseline = None
+        for workers in range(1, args.max_workers + 1):
+            throughput = measure(workers, args.clients, args.duration, directory)
+            baseline = baseline or throughput
+            print(f'{workers} workers: {throughput:,.0f} req/s ({throughput / baseline:.2f}x)')
+
+
+if __name__ == '__main__':
+    run()
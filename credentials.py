@@ -0,0 +1,115 @@
+"""Operator credentials. Run as script to print credentials file line with salted hash of given user's password:
+    $ python credentials.py username
+"""
+from collections import OrderedDict
+from getpass import getpass
+from hmac import new as hmac_new
+from os import environ, stat
+from secrets import compare_digest, token_bytes
+from sys import argv
+from time import monotonic
+
+from hashing import DEFAULT_COST, hasher, hash_password
+from utils import logger
+
+# verified for unknown users with the same cost as real hashes (derived key never matches)
+DUMMY_HASH = '$'.join(['pbkdf2_sha256', *map(str, DEFAULT_COST['pbkdf2_sha256']), token_bytes(16).hex(), '0' * 64])
+
+
+class EnvironmentCredentials:
+    """Single user credentials from USER_LOGIN and USER_PASSWORD variables."""
+
+    async def verify(self, username: str, password: str) -> bool:
+        """Return True if credentials match (resistant to time attacks)."""
+        correct_username = compare_digest(username.encode('utf8'), environ['USER_LOGIN'].encode('utf8'))
+        correct_password = compare_digest(password.encode('utf8'), environ['USER_PASSWORD'].encode('utf8'))
+        return correct_username and correct_password
+
+
+class CredentialStore:
+    """Salted password hashes of many users loaded from file with 'username:hash' lines and indexed by username. File
+    is reloaded when it changes (checked at most every reload_interval seconds). Recent successful verifications are
+    cached for cache_ttl seconds, keyed by HMAC of credentials so passwords are not kept in memory."""
+
+    def __init__(self, path: str, reload_interval: float = 1, cache_size: int = 4096, cache_ttl: float = 300):
+        self.path = path
+        self.reload_interval = reload_interval
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+        self.cache = OrderedDict()
+        self.cache_key = token_bytes(32)
+        self.hashes = {}
+        self.version = None
+        self.checked = monotonic()
+        self.load()
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def load(self):
+        """Read password hashes from file."""
+        version = self._file_version()
+        hashes = {}
+        with open(self.path, encoding='utf8') as file:
+            for line in file:
+                line = line.strip()
+                if line and not line.startswith('#'):
+                    username, password_hash = line.split(':', 1)
+                    hashes[username] = password_hash
+        self.hashes, self.version = hashes, version
+
+    def reload_if_changed(self):
+        """Load file again if its modification time, size or inode changed. If file can't be read or parsed, previous
+        hashes are kept and error is logged."""
+        now = monotonic()
+        if now - self.checked < self.reload_interval:
+            return
+        self.checked = now
+        try:
+            version = self._file_version()
+            if version != self.version:
+                # invalid file is not parsed again until it changes
+                self.version = version
+                self.load()
+        except (OSError, ValueError):
+            logger.exception('credentials_reload_failed', extra={'path': self.path})
+
+    def _file_version(self):
+        """Return modification time, size and inode of file."""
+        file_stat = stat(self.path)
+        return file_stat.st_mtime_ns, file_stat.st_size, file_stat.st_ino
+
+    async def verify(self, username: str, password: str) -> bool:
+        """Return True if password matches user's hash. Unknown users are verified against dummy hash, so response
+        time doesn't reveal which users exist."""
+        self.reload_if_changed()
+        password_hash = self.hashes.get(username)
+        key = hmac_new(self.cache_key, f'{username}\0{password}'.encode('utf8'), 'sha256').digest()
+        cached = self.cache.get(key)
+        if cached is not None and password_hash is not None:
+            cached_hash, expires = cached
+            if expires > monotonic() and compare_digest(cached_hash.encode(), password_hash.encode()):
+                self.cache.move_to_end(key)
+                return True
+            del self.cache[key]
+
+        valid = await hasher.verify(password, password_hash or DUMMY_HASH)
+        if not valid or password_hash is None:
+            return False
+        self.cache[key] = (password_hash, monotonic() + self.cache_ttl)
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return True
+
+
+def create_credential_store():
+    """Return credential store loaded from CREDENTIALS_FILE or single user from USER_LOGIN and USER_PASSWORD variables
+    if file is not set."""
+    path = environ.get('CREDENTIALS_FILE')
+    if path is None:
+        return EnvironmentCredentials()
+    return CredentialStore(path)
+
+
+if __name__ == '__main__':
+    print(f'{argv[1]}:{hash_password(getpass())}')
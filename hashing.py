@@ -0,0 +1,145 @@
+from asyncio import gather, get_event_loop
+from fastapi import HTTPException, status
+from hashlib import pbkdf2_hmac, scrypt, sha512
+from os import cpu_count, environ
+from secrets import compare_digest, token_hex
+
+DEFAULT_COST = {'pbkdf2_sha256': (260000,), 'scrypt': (16384, 8, 1)}
+
+
+def parse_max_cost(text: str):
+    """Return {algorithm: cost} dictionary parsed from 'algorithm=cost:cost,...' text."""
+    max_cost = {}
+    for item in filter(None, text.split(',')):
+        algorithm, cost = item.split('=')
+        max_cost[algorithm.strip()] = tuple(map(int, cost.split(':')))
+    return max_cost
+
+
+# the highest accepted cost parameters of verified hashes, so caller can't occupy workers for long
+MAX_COST = {'pbkdf2_sha256': (1000000,), 'scrypt': (131072, 16, 4), **parse_max_cost(environ.get('HASH_MAX_COST', ''))}
+
+
+def hash_password(password: str, algorithm: str = 'pbkdf2_sha256', cost: tuple = None) -> str:
+    """Return salted password hash in 'algorithm$cost...$salt$hash' format."""
+    cost = cost or DEFAULT_COST[algorithm]
+    salt = token_hex(16)
+    return '$'.join([algorithm, *map(str, cost), salt, derive(password, algorithm, cost, salt)])
+
+
+def derive(password: str, algorithm: str, cost: tuple, salt: str) -> str:
+    """Return hex key derived from password with given algorithm, cost parameters and salt."""
+    if algorithm == 'pbkdf2_sha256':
+        return pbkdf2_hmac('sha256', password.encode('utf8'), salt.encode(), cost[0]).hex()
+    elif algorithm == 'scrypt':
+        n, r, p = cost
+        return scrypt(password.encode('utf8'), salt=salt.encode(), n=n, r=r, p=p, maxmem=256 * n * r + 2 ** 20).hex()
+    raise ValueError(f'Unknown hash algorithm: {algorithm}')
+
+
+def is_slow_hash(password_hash: str) -> bool:
+    """Return True if hash is made with key derivation function (not plain SHA-512)."""
+    return '$' in password_hash
+
+
+def is_allowed_cost(algorithm: str, cost: tuple) -> bool:
+    """Return True if algorithm is known and every cost parameter is positive and not above its maximum."""
+    max_cost = MAX_COST.get(algorithm)
+    return (max_cost is not None and len(cost) == len(max_cost)
+            and all(0 < value <= limit for value, limit in zip(cost, max_cost)))
+
+
+def verify_password(password: str, password_hash: str) -> bool:
+    """Return True if password matches salted KDF hash or plain SHA-512 hex digest (comparison resistant to time
+    attacks). Malformed hashes and hashes with cost above maximum don't match."""
+    if not password or not password_hash:
+        return False
+    if not is_slow_hash(password_hash):
+        return compare_digest(sha512(password.encode('utf8')).hexdigest().encode(), password_hash.encode('utf8'))
+    try:
+        algorithm, *cost, salt, expected = password_hash.split('$')
+        cost = tuple(map(int, cost))
+        if not is_allowed_cost(algorithm, cost):
+            return False
+        derived = derive(password, algorithm, cost, salt)
+    except (ValueError, TypeError, OverflowError):
+        return False
+    return compare_digest(derived.encode(), expected.encode('utf8'))
+
+
+def verify_passwords(pairs: list) -> list:
+    """Return verification results of (password, password_hash) pairs."""
+    return [verify_password(password, password_hash) for password, password_hash in pairs]
+
+
+class PasswordHasher:
+    """Runs password verification with slow key derivation functions in process pool, so CPU work doesn't block
+    event loop. Raises 503 error when more than max_pending verifications are queued."""
+
+    def __init__(self, workers: int = None, max_pending: int = None):
+        self.workers = workers or cpu_count()
+        self.max_pending = max_pending or 256 * self.workers
+        self.pending = 0
+        self.executor = None
+
+    async def verify(self, password: str, password_hash: str) -> bool:
+        """Return True if password matches hash - plain SHA-512 hashes are checked inline."""
+        if not is_slow_hash(password_hash):
+            return verify_password(password, password_hash)
+        return (await self._submit([(password, password_hash)]))[0]
+
+    async def verify_many(self, pairs: list) -> list:
+        """Return verification results of (password, password_hash) pairs - slow hashes are split between all
+        workers."""
+        results = [None if is_slow_hash(password_hash) else verify_password(password, password_hash)
+                   for password, password_hash in pairs]
+        slow = [position for position, result in enumerate(results) if result is None]
+        if slow:
+            self._reserve(len(slow))
+            size = -(-len(slow) // self.workers)
+            chunks = [slow[start:start + size] for start in range(0, len(slow), size)]
+            try:
+                chunk_results = await gather(*(self._run([pairs[position] for position in chunk]) for chunk in chunks))
+            finally:
+                self.pending -= len(slow)
+            for chunk, chunk_result in zip(chunks, chunk_results):
+                for position, result in zip(chunk, chunk_result):
+                    results[position] = result
+        return results
+
+    def shutdown(self):
+        """Stop worker processes."""
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+    async def _submit(self, pairs: list) -> list:
+        """Verify pairs in single worker process."""
+        self._reserve(len(pairs))
+        try:
+            return await self._run(pairs)
+        finally:
+            self.pending -= len(pairs)
+
+    def _reserve(self, count: int):
+        """Count queued verifications or raise exception if pool is saturated."""
+        if self.pending + count > self.max_pending:
+            raise HTTPException(status.HTTP_503_SERVICE_UNAVAILABLE, detail='Password verification overloaded',
+                                headers={'Retry-After': '1'})
+        self.pending += count
+
+    async def _run(self, pairs: list) -> list:
+        """Run verification in process pool started on first use (process pool module is imported only then)."""
+        if self.executor is None:
+            from concurrent.futures import ProcessPoolExecutor
+            self.executor = ProcessPoolExecutor(self.workers)
+        return await get_event_loop().run_in_executor(self.executor, verify_passwords, pairs)
+
+
+def create_hasher():
+    """Return password hasher configured with HASH_WORKERS and HASH_MAX_PENDING variables."""
+    workers, max_pending = environ.get('HASH_WORKERS'), environ.get('HASH_MAX_PENDING')
+    return PasswordHasher(workers and int(workers), max_pending and int(max_pending))
+
+
+hasher = create_hasher()
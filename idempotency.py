@@ -0,0 +1,124 @@
+from collections import OrderedDict
+from hashlib import sha256
+from json import dumps
+from os import environ
+from time import monotonic
+
+MAX_KEY_LENGTH = 255
+
+
+class ResponseCache:
+    """Responses saved under keys for ttl seconds, at most capacity of them - the oldest ones are dropped first."""
+
+    def __init__(self, ttl: float = 86400, capacity: int = 100000):
+        self.ttl = ttl
+        self.capacity = capacity
+        self.responses = OrderedDict()
+
+    def __len__(self):
+        return len(self.responses)
+
+    def get(self, key):
+        """Return saved response or None if not found or expired."""
+        entry = self.responses.get(key)
+        if entry is None or entry[0] <= monotonic():
+            return None
+        return entry[1]
+
+    def set(self, key, response):
+        """Save response and drop expired ones and the oldest over capacity."""
+        now = monotonic()
+        self.responses.pop(key, None)
+        self.responses[key] = (now + self.ttl, response)
+        while self.responses and (len(self.responses) > self.capacity
+                                  or next(iter(self.responses.values()))[0] <= now):
+            self.responses.popitem(last=False)
+
+
+class IdempotencyMiddleware:
+    """ASGI middleware replaying saved successful response to POST request on given paths repeated with the same
+    Idempotency-Key header and body, without calling application. Request with key of request still being processed
+    gets 409 response, request with used key and different body gets 422 response."""
+
+    def __init__(self, app, paths: set, ttl: float = 86400, capacity: int = 100000):
+        self.app = app
+        self.paths = paths
+        self.cache = ResponseCache(ttl, capacity)
+        self.in_progress = {}
+
+    async def __call__(self, scope, receive, send):
+        key = None
+        if scope['type'] == 'http' and scope['method'] == 'POST' and scope['path'] in self.paths:
+            key = next((value for name, value in scope['headers'] if name == b'idempotency-key'), None)
+        if key is None:
+            await self.app(scope, receive, send)
+            return
+
+        if len(key) > MAX_KEY_LENGTH:
+            await send_error(send, 400, f'Idempotency-Key can have at most {MAX_KEY_LENGTH} characters')
+            return
+        messages, digest = await read_body(receive)
+        cache_key = (scope['path'], key)
+        saved = self.cache.get(cache_key)
+        if saved is not None or cache_key in self.in_progress:
+            saved_digest = saved[3] if saved is not None else self.in_progress[cache_key]
+            if saved_digest != digest:
+                await send_error(send, 422, 'Idempotency-Key was used with different request body')
+            elif saved is not None:
+                status_code, headers, body, _ = saved
+                await send({'type': 'http.response.start', 'status': status_code,
+                            'headers': headers + [(b'idempotent-replayed', b'true')]})
+                await send({'type': 'http.response.body', 'body': body})
+            else:
+                await send_error(send, 409, 'Request with this Idempotency-Key is being processed')
+            return
+
+        start, body = None, []
+
+        async def receive_read():
+            return messages.pop(0) if messages else await receive()
+
+        async def send_and_save(message):
+            nonlocal start
+            if message['type'] == 'http.response.start':
+                start = message
+            elif message['type'] == 'http.response.body':
+                body.append(message.get('body', b''))
+            await send(message)
+
+        self.in_progress[cache_key] = digest
+        try:
+            await self.app(scope, receive_read, send_and_save)
+        finally:
+            self.in_progress.pop(cache_key, None)
+        if start is not None and 200 <= start['status'] < 300:
+            self.cache.set(cache_key, (start['status'], list(start.get('headers', [])), b''.join(body), digest))
+
+
+async def read_body(receive):
+    """Return received request messages and SHA-256 digest of request body."""
+    messages, digest = [], sha256()
+    while True:
+        message = await receive()
+        messages.append(message)
+        if message['type'] != 'http.request':
+            break
+        digest.update(message.get('body', b''))
+        if not message.get('more_body', False):
+            break
+    return messages, digest.digest()
+
+
+async def send_error(send, status_code: int, detail: str):
+    """Send JSON error response."""
+    body = dumps({'detail': detail}).encode()
+    await send({'type': 'http.response.start', 'status': status_code,
+                'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())]})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+def idempotency_options():
+    """Return middleware options configured with IDEMPOTENCY_TTL (seconds, 1 day by default) and
+    IDEMPOTENCY_CACHE_SIZE variables."""
+    return {'paths': {'/register'}, 'ttl': float(environ.get('IDEMPOTENCY_TTL', 86400)),
+            'capacity': int(environ.get('IDEMPOTENCY_CACHE_SIZE', 100000))}
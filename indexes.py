@@ -0,0 +1,141 @@
+from bisect import bisect_left, bisect_right, insort
+from heapq import merge
+from os import environ
+
+# names and surnames are also indexed by prefixes up to this length, which match the most keys
+PREFIX_LENGTH = 2
+
+
+def normalize(text: str) -> str:
+    """Return text normalized for case insensitive search."""
+    return text.strip().casefold()
+
+
+def duplicate_key(name: str, surname: str) -> tuple:
+    """Return normalized name and surname identifying duplicated patients."""
+    return normalize(name), normalize(surname)
+
+
+class SortedIndex:
+    """Secondary index mapping sorted keys to ascending lists of patient ids. With prefix_length ids are also listed
+    under every prefix of key up to this length, so short prefixes are searched in single list instead of merging
+    thousands of keys."""
+
+    def __init__(self, prefix_length: int = 0):
+        self.ids = {}
+        self.keys = []
+        self.prefix_length = prefix_length
+        self.prefixes = {}
+
+    def add(self, key, patient_id: int):
+        """Save patient id under given key - ids have to be added in ascending order."""
+        ids = self.ids.get(key)
+        if ids is None:
+            self.ids[key] = ids = []
+            insort(self.keys, key)
+        ids.append(patient_id)
+        if self.prefix_length:
+            for length in range(1, min(len(key), self.prefix_length) + 1):
+                prefix_ids = self.prefixes.get(key[:length])
+                if prefix_ids is None:
+                    self.prefixes[key[:length]] = prefix_ids = []
+                prefix_ids.append(patient_id)
+
+    def key_range(self, first=None, last=None):
+        """Return keys between first and last (inclusive)."""
+        start = 0 if first is None else bisect_left(self.keys, first)
+        end = len(self.keys) if last is None else bisect_right(self.keys, last)
+        return self.keys[start:end]
+
+    def prefix_keys(self, prefix: str):
+        """Return keys starting with given prefix."""
+        start = bisect_left(self.keys, prefix)
+        end = bisect_left(self.keys, prefix + '\U0010ffff', start)
+        return self.keys[start:end]
+
+    def exact_lists(self, key):
+        """Return list with ascending ids of given key (empty if key is not saved)."""
+        return [self.ids[key]] if key in self.ids else []
+
+    def prefix_lists(self, prefix: str):
+        """Return ascending id lists of keys starting with given prefix - single list of all of them if prefix is not
+        longer than prefix_length."""
+        if 0 < len(prefix) <= self.prefix_length:
+            return [self.prefixes[prefix]] if prefix in self.prefixes else []
+        return [self.ids[key] for key in self.prefix_keys(prefix)]
+
+    def range_lists(self, first=None, last=None):
+        """Return ascending id lists of keys between first and last (inclusive)."""
+        return [self.ids[key] for key in self.key_range(first, last)]
+
+
+def merge_ids(lists: list, after_id: int = 0):
+    """Return iterator over ascending ids greater than after_id from given ascending lists - ids are read by position
+    from bisected start, so skipped ids of deep pages are not walked."""
+    iterators = [map(ids.__getitem__, range(bisect_right(ids, after_id), len(ids))) for ids in lists]
+    return iterators[0] if len(iterators) == 1 else merge(*iterators)
+
+
+class PatientIndex:
+    """Secondary indexes of patient records - by normalized surname and name and by vaccination and register dates.
+    With deduplicate option also id of the first patient with given normalized name and surname is saved."""
+
+    def __init__(self, deduplicate: bool = False):
+        self.surnames = SortedIndex(PREFIX_LENGTH)
+        self.names = SortedIndex(PREFIX_LENGTH)
+        self.vaccination_dates = SortedIndex()
+        self.register_dates = SortedIndex()
+        self.duplicates = {} if deduplicate else None
+
+    def add(self, patient):
+        """Add patient to all indexes - patients have to be added in ascending id order."""
+        self.surnames.add(normalize(patient.surname), patient.id)
+        self.names.add(normalize(patient.name), patient.id)
+        self.vaccination_dates.add(patient.vaccination_date, patient.id)
+        self.register_dates.add(patient.register_date, patient.id)
+        if self.duplicates is not None:
+            self.duplicates.setdefault(duplicate_key(patient.name, patient.surname), patient.id)
+
+    def find_duplicate(self, name: str, surname: str):
+        """Return id of patient registered with the same normalized name and surname or None if not found or
+        duplicates are not indexed."""
+        if self.duplicates is None:
+            return None
+        return self.duplicates.get(duplicate_key(name, surname))
+
+    def extend(self, patients):
+        """Add patients to all indexes - patients have to be added in ascending id order."""
+        for patient in patients:
+            self.add(patient)
+
+    def search(self, surname: str = None, name: str = None, prefix: bool = False, vaccination_from=None,
+               vaccination_to=None, register_from=None, register_to=None, after_id: int = 0):
+        """Return (ids, filters) pair - iterator over ascending ids greater than after_id from the most selective
+        index and list of remaining (attribute, predicate) filters which have to be checked on patient records. Ids are
+        None if no index filter is given."""
+        candidates = []
+        for attribute, index, value in [('surname', self.surnames, surname), ('name', self.names, name)]:
+            if value is not None:
+                value = normalize(value)
+                lists = index.prefix_lists(value) if prefix else index.exact_lists(value)
+                predicate = ((lambda text, v=value: normalize(text).startswith(v)) if prefix
+                             else (lambda text, v=value: normalize(text) == v))
+                candidates.append((sum(map(len, lists)), lists, attribute, predicate))
+        for attribute, index, first, last in [('vaccination_date', self.vaccination_dates, vaccination_from,
+                                               vaccination_to),
+                                              ('register_date', self.register_dates, register_from, register_to)]:
+            if first is not None or last is not None:
+                predicate = (lambda day, f=first, l=last: (f is None or day >= f) and (l is None or day <= l))
+                lists = index.range_lists(first, last)
+                candidates.append((sum(map(len, lists)), lists, attribute, predicate))
+
+        if not candidates:
+            return None, []
+        candidates.sort(key=lambda candidate: candidate[0])
+        return (merge_ids(candidates[0][1], after_id),
+                [(attribute, predicate) for _, _, attribute, predicate in candidates[1:]])
+
+
+def create_index():
+    """Return patient index with duplicates indexed if DEDUPLICATE_PATIENTS variable is set to 1."""
+    return PatientIndex(deduplicate=environ.get('DEDUPLICATE_PATIENTS') == '1')
@@ -0,0 +1,280 @@
+from collections import OrderedDict
+from heapq import heappush, heappop
+from hmac import compare_digest, new as hmac_new
+from os import environ
+from starlette.concurrency import run_in_threadpool
+from threading import Lock, Thread
+from time import monotonic, sleep, time
+
+from utils import create_login_key
+
+
+class SessionCache:
+    """Login keys kept in process memory in hash map ordered from least recently used. Keys expire after ttl seconds
+    without use (checked lazily on lookup and by background sweeper), the least recently used key is evicted when
+    capacity is exceeded."""
+
+    def __init__(self, capacity: int = 3, ttl: float = None, sweep_interval: float = 60):
+        self.capacity = capacity
+        self.ttl = ttl
+        self.keys = OrderedDict()
+        self.lock = Lock()
+        self.hits = self.misses = self.evictions = self.expirations = 0
+        if ttl is not None:
+            Thread(target=self._sweep_periodically, args=(sweep_interval,), name='session-cache-sweeper',
+                   daemon=True).start()
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, key):
+        with self.lock:
+            if key not in self.keys:
+                self.misses += 1
+                return False
+            if self.ttl is not None:
+                expires, now = self.keys[key], monotonic()
+                if expires <= now:
+                    del self.keys[key]
+                    self.expirations += 1
+                    self.misses += 1
+                    return False
+                self.keys[key] = now + self.ttl
+            self.keys.move_to_end(key)
+            self.hits += 1
+            return True
+
+    def create(self):
+        """Return new saved key."""
+        key = create_login_key()
+        self.append(key)
+        return key
+
+    def append(self, key: str):
+        """Save key, the least recently used one is evicted if cache is full."""
+        with self.lock:
+            self.keys[key] = None if self.ttl is None else monotonic() + self.ttl
+            self.keys.move_to_end(key)
+            if len(self.keys) > self.capacity:
+                self.keys.popitem(last=False)
+                self.evictions += 1
+
+    def remove(self, key: str):
+        """Delete key if it is saved."""
+        with self.lock:
+            self.keys.pop(key, None)
+
+    def sweep(self):
+        """Delete expired keys - they are always at the beginning of the cache."""
+        if self.ttl is None:
+            return
+        with self.lock:
+            now = monotonic()
+            while self.keys:
+                key, expires = next(iter(self.keys.items()))
+                if expires > now:
+                    break
+                del self.keys[key]
+                self.expirations += 1
+
+    def stats(self):
+        """Return cache size and hit, miss, eviction and expiration counters."""
+        return {'size': len(self.keys), 'capacity': self.capacity, 'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions, 'expirations': self.expirations}
+
+    def _sweep_periodically(self, interval: float):
+        """Delete expired keys every interval seconds."""
+        while True:
+            sleep(interval)
+            self.sweep()
+
+
+class SQLiteKeyStore:
+    """Login keys kept in SQLite database file shared by all processes on a host - only last capacity keys of given
+    kind are valid. With ttl keys expire after ttl seconds without use (wall clock time, so it is the same for all
+    processes)."""
+
+    def __init__(self, path: str, kind: str, capacity: int = 3, ttl: float = None):
+        self.kind = kind
+        self.capacity = capacity
+        self.ttl = ttl
+        import sqlite3
+        self.lock = Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=5)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS login_keys (id INTEGER PRIMARY KEY AUTOINCREMENT, '
+                                'kind TEXT NOT NULL, key TEXT NOT NULL, expires REAL, UNIQUE (kind, key))')
+        self.connection.execute('CREATE INDEX IF NOT EXISTS login_keys_kind ON login_keys (kind, id)')
+
+    def __contains__(self, key):
+        with self.lock:
+            row = self.connection.execute('SELECT expires FROM login_keys WHERE kind = ? AND key = ?',
+                                          (self.kind, key)).fetchone()
+            if row is None or self.ttl is None:
+                return row is not None
+            now = time()
+            if row[0] is not None and row[0] <= now:
+                self.connection.execute('DELETE FROM login_keys WHERE kind = ? AND key = ?', (self.kind, key))
+                return False
+            self.connection.execute('UPDATE login_keys SET expires = ? WHERE kind = ? AND key = ?',
+                                    (now + self.ttl, self.kind, key))
+            return True
+
+    def create(self):
+        """Return new saved key."""
+        key = create_login_key()
+        self.append(key)
+        return key
+
+    def append(self, key: str):
+        """Save key, the oldest one is dropped if store is full."""
+        with self.lock, self.connection:
+            self.connection.execute('BEGIN IMMEDIATE')
+            expires = None if self.ttl is None else time() + self.ttl
+            self.connection.execute('INSERT OR IGNORE INTO login_keys (kind, key, expires) VALUES (?, ?, ?)',
+                                    (self.kind, key, expires))
+            self.connection.execute('DELETE FROM login_keys WHERE kind = ? AND id <= (SELECT id FROM login_keys '
+                                    'WHERE kind = ? ORDER BY id DESC LIMIT 1 OFFSET ?)',
+                                    (self.kind, self.kind, self.capacity))
+            if self.ttl is not None:
+                self.connection.execute('DELETE FROM login_keys WHERE kind = ? AND expires <= ?', (self.kind, time()))
+
+    def remove(self, key: str):
+        """Delete key if it is saved."""
+        with self.lock:
+            self.connection.execute('DELETE FROM login_keys WHERE kind = ? AND key = ?', (self.kind, key))
+
+    async def create_async(self):
+        """Return new saved key without blocking event loop."""
+        return await run_in_threadpool(self.create)
+
+    async def contains_async(self, key: str):
+        """Check if key is saved without blocking event loop."""
+        return await run_in_threadpool(self.__contains__, key)
+
+    async def remove_async(self, key: str):
+        """Delete key without blocking event loop."""
+        await run_in_threadpool(self.remove, key)
+
+
+class DenyList:
+    """Revoked key nonces kept only until keys expire."""
+
+    def __init__(self):
+        self.expires = {}
+        self.queue = []
+
+    def __contains__(self, nonce):
+        return nonce in self.expires
+
+    def add(self, nonce: str, expires: int):
+        """Revoke nonce until given timestamp and forget already expired ones."""
+        now = time()
+        while self.queue and self.queue[0][0] < now:
+            del self.expires[heappop(self.queue)[1]]
+        if nonce not in self.expires:
+            self.expires[nonce] = expires
+            heappush(self.queue, (expires, nonce))
+
+
+class SQLiteDenyList:
+    """Revoked key nonces kept in SQLite database file shared by all processes on a host until keys expire."""
+
+    def __init__(self, path: str):
+        import sqlite3
+        self.lock = Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=5)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS revoked_keys (nonce TEXT PRIMARY KEY, '
+                                'expires INTEGER NOT NULL)')
+
+    def __contains__(self, nonce):
+        with self.lock:
+            return self.connection.execute('SELECT 1 FROM revoked_keys WHERE nonce = ?', (nonce,)).fetchone() is not None
+
+    def add(self, nonce: str, expires: int):
+        """Revoke nonce until given timestamp and forget already expired ones."""
+        with self.lock, self.connection:
+            self.connection.execute('BEGIN IMMEDIATE')
+            self.connection.execute('INSERT OR IGNORE INTO revoked_keys (nonce, expires) VALUES (?, ?)',
+                                    (nonce, expires))
+            self.connection.execute('DELETE FROM revoked_keys WHERE expires < ?', (time(),))
+
+
+class SignedKeyStore:
+    """Stateless login keys - nonce and expiry time signed with HMAC, so they can be validated without lookup in any
+    shared state. Only removed keys are remembered in deny list until they expire."""
+
+    def __init__(self, kind: str, secret: bytes, ttl: int = 3600, deny_list=None):
+        self.kind = kind
+        self.secret = secret
+        self.ttl = ttl
+        self.deny_list = DenyList() if deny_list is None else deny_list
+
+    def __contains__(self, key):
+        try:
+            nonce, expires, signature = key.split('.')
+            expires = int(expires)
+        except (AttributeError, ValueError):
+            return False
+        return (compare_digest(signature.encode('utf8'), self._sign(nonce, expires).encode()) and expires > time()
+                and nonce not in self.deny_list)
+
+    def create(self):
+        """Return new signed key."""
+        nonce, expires = create_login_key(), int(time()) + self.ttl
+        return f'{nonce}.{expires}.{self._sign(nonce, expires)}'
+
+    def append(self, key: str):
+        """Nothing to save - signed keys are valid until they expire."""
+
+    def remove(self, key: str):
+        """Revoke key until it expires."""
+        if key in self:
+            nonce, expires, _ = key.split('.')
+            self.deny_list.add(nonce, int(expires))
+
+    def _sign(self, nonce: str, expires: int):
+        """Return HMAC-SHA256 signature of key kind, nonce and expiry time."""
+        return hmac_new(self.secret, f'{self.kind}.{nonce}.{expires}'.encode(), 'sha256').hexdigest()
+
+
+class SharedSignedKeyStore(SignedKeyStore):
+    """Stateless login keys with deny list in SQLite database file, so logged out keys are revoked in all processes
+    on a host."""
+
+    def __init__(self, kind: str, secret: bytes, ttl: int, path: str):
+        super().__init__(kind, secret, ttl, SQLiteDenyList(path))
+
+    async def contains_async(self, key: str):
+        """Check if key is valid and not revoked without blocking event loop."""
+        return await run_in_threadpool(self.__contains__, key)
+
+    async def remove_async(self, key: str):
+        """Revoke key without blocking event loop."""
+        await run_in_threadpool(self.remove, key)
+
+
+def create_key_store(kind: str):
+    """Return login key store configured with AUTH_MODE ('stateful' or 'stateless'), KEY_STORE ('memory' or 'sqlite')
+    and KEY_STORE_PATH variables. Stateless keys are signed with SECRET_KEY and expire after LOGIN_KEY_TTL seconds,
+    their deny list is kept in worker memory or in SQLite file with KEY_STORE=sqlite.
+    Memory and SQLite stores keep SESSION_CAPACITY keys unused for at most SESSION_TTL seconds."""
+    if environ.get('AUTH_MODE', 'stateful') == 'stateless':
+        if not environ.get('SECRET_KEY'):
+            raise ValueError('SECRET_KEY variable is required in stateless AUTH_MODE')
+        secret, ttl = environ['SECRET_KEY'].encode(), int(environ.get('LOGIN_KEY_TTL', 3600))
+        if environ.get('KEY_STORE', 'memory') == 'sqlite':
+            return SharedSignedKeyStore(kind, secret, ttl, environ.get('KEY_STORE_PATH', 'keys.db'))
+        return SignedKeyStore(kind, secret, ttl)
+
+    backend = environ.get('KEY_STORE', 'memory')
+    capacity, ttl = int(environ.get('SESSION_CAPACITY', 3)), environ.get('SESSION_TTL')
+    ttl = None if ttl is None else float(ttl)
+    if backend == 'memory':
+        return SessionCache(capacity, ttl)
+    elif backend == 'sqlite':
+        return SQLiteKeyStore(environ.get('KEY_STORE_PATH', 'keys.db'), kind, capacity, ttl)
+    raise ValueError(f'Unknown key store: {backend}')
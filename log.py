@@ -0,0 +1,91 @@
+from datetime import datetime, timezone
+from json import dumps
+from logging import Filter, Formatter, LogRecord, StreamHandler
+from logging.handlers import QueueHandler, QueueListener
+from os import environ
+from queue import SimpleQueue
+from random import random
+from time import monotonic
+
+SECRET_FIELDS = {'password', 'token', 'session_token', 'credentials', 'authorization', 'secret'}
+RECORD_ATTRIBUTES = set(vars(LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime'}
+
+
+class JsonFormatter(Formatter):
+    """Formats log record as single line JSON object with event message, level, time and extra record fields. Values
+    of secret fields are redacted."""
+
+    def format(self, record):
+        data = {'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+                'level': record.levelname, 'logger': record.name, 'event': record.getMessage()}
+        for name, value in vars(record).items():
+            if name not in RECORD_ATTRIBUTES:
+                data[name] = '[REDACTED]' if name in SECRET_FIELDS else value
+        if record.exc_info:
+            data['exception'] = self.formatException(record.exc_info)
+        return dumps(data, default=str, ensure_ascii=False)
+
+
+class SamplingFilter(Filter):
+    """Passes only given fraction of records with sampled events (1 for events not listed)."""
+
+    def __init__(self, rates: dict):
+        super().__init__()
+        self.rates = rates
+
+    def filter(self, record):
+        rate = self.rates.get(record.msg)
+        return rate is None or random() < rate
+
+
+class RateLimitFilter(Filter):
+    """Passes at most rate records of every event per second (token bucket per event)."""
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+        self.buckets = {}
+
+    def filter(self, record):
+        now = monotonic()
+        tokens, updated = self.buckets.get(record.msg, (self.rate, now))
+        tokens = min(self.rate, tokens + (now - updated) * self.rate)
+        if tokens < 1:
+            self.buckets[record.msg] = (tokens, now)
+            return False
+        self.buckets[record.msg] = (tokens - 1, now)
+        return True
+
+
+class BackgroundHandler(QueueHandler):
+    """Puts records in queue without formatting them - formatting and writing is done by listener thread."""
+
+    def prepare(self, record):
+        return record
+
+
+def parse_rates(text: str):
+    """Return {event: rate} dictionary parsed from 'event=rate,event=rate' text."""
+    rates = {}
+    for item in filter(None, text.split(',')):
+        event, rate = item.split('=')
+        rates[event.strip()] = float(rate)
+    return rates
+
+
+def setup_logging(logger, stream=None):
+    """Attach background handler to logger and return started listener writing JSON records to stream (stderr by
+    default). Configured with LOG_LEVEL, LOG_SAMPLE_RATES ('event=rate,...') and LOG_RATE_LIMIT (records per second
+    of every event) variables."""
+    queue = SimpleQueue()
+    handler = BackgroundHandler(queue)
+    handler.addFilter(SamplingFilter(parse_rates(environ.get('LOG_SAMPLE_RATES', ''))))
+    handler.addFilter(RateLimitFilter(float(environ.get('LOG_RATE_LIMIT', 1000))))
+    output = StreamHandler(stream)
+    output.setFormatter(JsonFormatter())
+    logger.handlers = [handler]
+    logger.setLevel(environ.get('LOG_LEVEL', 'INFO'))
+    logger.propagate = False
+    listener = QueueListener(queue, output)
+    listener.start()
+    return listener
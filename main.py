@@ -1,68 +1,355 @@
-from fastapi import FastAPI, Request, Response, HTTPException, status, Path
-from fastapi.responses import HTMLResponse
-from hashlib import sha512
+from fastapi import FastAPI, Request, Response, HTTPException, status, Path, Query
+from fastapi.responses import HTMLResponse, PlainTextResponse, StreamingResponse
+from pydantic import ValidationError
+from starlette.concurrency import run_in_threadpool
+from array import array
 from datetime import timedelta, date
+from functools import lru_cache, partial
+from itertools import islice
+from json import dumps
+from os import environ
+from typing import List
 
-from models import UnregisteredPatient, Patient
+from models import (UnregisteredPatient, Patient, PatientPage, DayLoad, DayStats, Stats, ExportFormatEnum,
+                    PasswordPair)
 from auth import router
-from utils import logger
+from hashing import hasher
+from idempotency import IdempotencyMiddleware, idempotency_options
+from indexes import SortedIndex, create_index
+from log import setup_logging
+from metrics import metrics, MetricsMiddleware
+from openapi import prebuilt_openapi
+from pipeline import RegistrationPipeline
+from ratelimit import RateLimitMiddleware, rate_limit_options
+from scheduler import create_scheduler
+from stats import DayCounter, PatientStats
+from storage import create_storage
+from utils import (logger, count_letters, iter_json_records, export_patients, cached_response, render_body,
+                   NDJSONResponse)
+
+BATCH_CHUNK_SIZE = 1000
+MAX_PASSWORD_PAIRS = 256
+ROOT_MESSAGE = render_body(dumps({'message': 'Hello world!'}, separators=(',', ':')), 'application/json')
 
 app = FastAPI()
+if 'OPENAPI_FILE' in environ:
+    app.openapi = prebuilt_openapi(app, environ['OPENAPI_FILE'])
 
-app.patients = []
+app.patients = create_storage()
+app.index = create_index()
+app.scheduler = create_scheduler()
+app.stats = PatientStats()
+app.rebalancing = False
 app.include_router(router)
+app.add_middleware(IdempotencyMiddleware, **idempotency_options())
+app.add_middleware(RateLimitMiddleware, **rate_limit_options())
+app.add_middleware(MetricsMiddleware, metrics=metrics)
+
+
+def load_patients():
+    """Rebuild patient indexes, statistics and schedule from saved records."""
+    for patient in app.patients.scan():
+        app.index.add(patient)
+        app.stats.add(patient)
+        app.scheduler.book(patient.vaccination_date)
+
+
+load_patients()
+app.pipeline = RegistrationPipeline(app.patients, app.index, app.stats)
+
+
+@app.on_event('startup')
+def start_logging():
+    """Write application logs in background thread."""
+    app.log_listener = setup_logging(logger)
+
+
+@app.on_event('startup')
+def warm_up():
+    """Prepare OpenAPI schema and cached responses before the first request."""
+    app.openapi()
+    render_hello(date.today())
+
+
+@app.on_event('shutdown')
+def close_storage():
+    """Save pending patient records and remaining logs, stop password hashing workers."""
+    app.patients.close()
+    hasher.shutdown()
+    app.log_listener.stop()
 
 
 @app.get('/', tags=['helpers'])
-def read_root():
+async def read_root(request: Request):
     """Return simple message."""
-    return {'message': 'Hello world!'}
+    return cached_response(ROOT_MESSAGE, request, 'public, max-age=3600')
 
 
 @app.post('/method', status_code=status.HTTP_201_CREATED, tags=['helpers'])
 @app.api_route('/method', methods=['GET', 'DELETE', 'PUT', 'OPTIONS'], tags=['helpers'])
-def return_request_method(request: Request):
+async def return_request_method(request: Request):
     """Return requests HTTP method."""
     return {'method': request.method}
 
 
 @app.get('/auth', tags=['authentication'])
-def validate_password(password: str = '', password_hash: str = ''):
-    """Check if provided password and password_hash match."""
-    password_encoded = password.encode('utf8')
-    if not password or sha512(password_encoded).hexdigest() != password_hash:
+async def validate_password(password: str = '', password_hash: str = ''):
+    """Check if provided password and password_hash (SHA-512 hex digest or salted PBKDF2/scrypt hash) match."""
+    if not await hasher.verify(password, password_hash):
         raise HTTPException(status.HTTP_401_UNAUTHORIZED, detail='Password and hash dont match')
 
     return Response(status_code=status.HTTP_204_NO_CONTENT)
 
 
+@app.post('/auth/batch', tags=['authentication'])
+async def validate_passwords(pairs: List[PasswordPair]):
+    """Check if passwords and password hashes match for every given pair."""
+    if len(pairs) > MAX_PASSWORD_PAIRS:
+        raise HTTPException(status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                            detail=f'At most {MAX_PASSWORD_PAIRS} pairs can be verified at once')
+
+    return {'results': await hasher.verify_many([(pair.password, pair.password_hash) for pair in pairs])}
+
+
 @app.post('/register', status_code=status.HTTP_201_CREATED, response_model=Patient, tags=['patient'])
-def register_patient(unregistered_patient: UnregisteredPatient):
-    """Register patient and returns saved record."""
-    vaccination_delay = timedelta(days=len([letter for letter
-                                            in unregistered_patient.name + unregistered_patient.surname
-                                            if letter.isalpha()]))
+async def register_patient(unregistered_patient: UnregisteredPatient, response: Response):
+    """Register patient and returns saved record. If duplicates are indexed, already registered patient with the same
+    name and surname is returned instead."""
+    duplicate = await app.pipeline.find_duplicate(unregistered_patient.name, unregistered_patient.surname)
+    if duplicate is not None:
+        response.status_code = status.HTTP_200_OK
+        return duplicate
+
+    vaccination_delay = timedelta(days=count_letters(unregistered_patient.name + unregistered_patient.surname))
     patient = Patient(name=unregistered_patient.name, surname=unregistered_patient.surname,
-                      id=len(app.patients) + 1,
-                      vaccination_date=(date.today() + vaccination_delay))
-    app.patients.append(patient)
-    logger.info(f'Added {patient=}')
+                      vaccination_date=app.scheduler.assign(date.today() + vaccination_delay))
+    await app.pipeline.submit([patient])
+    metrics.inc('patient_registrations_total')
+    logger.info('patient_added', extra={'patient_id': patient.id})
     return patient
 
 
+@app.post('/register/batch', tags=['patient'])
+async def register_patients(request: Request):
+    """Register patients streamed in request body as NDJSON or JSON array. Returns NDJSON stream with saved record or
+    validation errors for every given record."""
+    return NDJSONResponse(register_stream(request.stream()))
+
+
+async def register_stream(chunks):
+    """Registers records parsed from body chunks in batches and yields NDJSON results."""
+    batch = []
+    async for item in iter_json_records(chunks):
+        batch.append(item)
+        if len(batch) >= BATCH_CHUNK_SIZE:
+            yield await register_batch(batch)
+            batch = []
+    if batch:
+        yield await register_batch(batch)
+
+
+async def register_batch(items: list) -> str:
+    """Validates and registers batch of parsed (index, record, error) items with contiguous ids. Returns NDJSON lines
+    with results in input order."""
+    results, valid = {}, []
+    for index, record, error in items:
+        if error:
+            results[index] = {'index': index, 'detail': [{'msg': error}]}
+        elif type(record) is dict and type(record.get('name')) is str and type(record.get('surname')) is str:
+            valid.append((index, record['name'], record['surname']))
+        else:
+            try:
+                patient = UnregisteredPatient.parse_obj(record)
+            except ValidationError as exc:
+                results[index] = {'index': index, 'detail': exc.errors()}
+            else:
+                valid.append((index, patient.name, patient.surname))
+
+    today = date.today()
+    delays = [count_letters(name + surname) for _, name, surname in valid]
+    preferred_dates = {delay: today + timedelta(days=delay) for delay in set(delays)}
+    patients = [Patient.construct(name=name, surname=surname, id=None, register_date=today,
+                                  vaccination_date=app.scheduler.assign(preferred_dates[delay]))
+                for (_, name, surname), delay in zip(valid, delays)]
+    await app.pipeline.submit(patients)
+    metrics.inc('patient_registrations_total', len(patients))
+    if patients:
+        logger.info('patients_added', extra={'first_id': patients[0].id, 'last_id': patients[-1].id})
+
+    for (index, _, _), patient in zip(valid, patients):
+        results[index] = {'index': index, 'patient': {'name': patient.name, 'surname': patient.surname,
+                                                      'id': patient.id,
+                                                      'register_date': patient.register_date.isoformat(),
+                                                      'vaccination_date': patient.vaccination_date.isoformat()}}
+
+    return ''.join(dumps(results[index]) + '\n' for index, _, _ in items)
+
+
 @app.get('/patient/{id}', response_model=Patient, tags=['patient'])
 def get_patient(patient_id: int = Path(0, alias='id')):
     """Reads patient record with given id."""
     if patient_id <= 0:
         raise HTTPException(status.HTTP_400_BAD_REQUEST, detail='Invalid ID')
-    elif patient_id > len(app.patients):
+
+    patient = app.patients.get(patient_id)
+    if patient is None:
         raise HTTPException(status.HTTP_404_NOT_FOUND, detail='Patient not found')
 
-    return app.patients[patient_id - 1]
+    return patient
+
+
+@app.get('/patients', response_model=PatientPage, tags=['patient'])
+def search_patients(surname: str = None, name: str = None, prefix: bool = False, vaccination_from: date = None,
+                    vaccination_to: date = None, register_from: date = None, register_to: date = None,
+                    after_id: int = Query(0, ge=0), limit: int = Query(50, ge=1, le=1000)):
+    """Return page of patient records matching all given filters ordered by id. Surname and name are matched case
+    insensitive as whole words or prefixes, dates ranges are inclusive."""
+    ids, filters = app.index.search(surname, name, prefix, vaccination_from, vaccination_to, register_from,
+                                    register_to, after_id)
+    if ids is None:
+        ids = range(after_id + 1, len(app.patients) + 1)
 
+    patients = []
+    for patient_id in ids:
+        patient = app.patients.get(patient_id)
+        if all(predicate(getattr(patient, attribute)) for attribute, predicate in filters):
+            patients.append(patient)
+            if len(patients) == limit:
+                break
 
-@app.get('/hello', tags=['helpers'])
-def read_html():
+    return PatientPage(patients=patients, next_after_id=patients[-1].id if len(patients) == limit else None)
+
+
+@app.get('/patients/export', tags=['patient'])
+def export_patient_records(export_format: ExportFormatEnum = Query(ExportFormatEnum.ndjson, alias='format'),
+                           after_id: int = Query(0, ge=0), limit: int = Query(None, ge=1)):
+    """Stream patient records with id greater than after_id (all by default) in NDJSON or CSV format. Interrupted
+    export can be resumed with after_id set to the last received id."""
+    patients = app.patients.scan(after_id)
+    if limit is not None:
+        patients = islice(patients, limit)
+    media_type = 'text/csv' if export_format == ExportFormatEnum.csv else 'application/x-ndjson'
+
+    return StreamingResponse(export_patients(patients, export_format), media_type=media_type)
+
+
+@app.get('/schedule', response_model=List[DayLoad], tags=['schedule'])
+def read_schedule(date_from: date = None, date_to: date = None):
+    """Return number of scheduled vaccinations and capacity of every day in given range (30 days from today by
+    default)."""
+    date_from = date_from or date.today()
+    date_to = date_to or date_from + timedelta(days=30)
+    if date_to < date_from or (date_to - date_from).days > 3660:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, detail='Invalid date range')
+
+    return [DayLoad(day=day, load=load, capacity=capacity)
+            for day, load, capacity in app.scheduler.report(date_from, date_to)]
+
+
+@app.put('/schedule/{day}', response_model=DayLoad, tags=['schedule'])
+async def set_day_capacity(day: date, capacity: int = Query(None, ge=0)):
+    """Set number of vaccinations possible on given day, without capacity default one is restored. Already scheduled
+    vaccinations are moved only by rebalance."""
+    app.scheduler.set_capacity(day, capacity)
+    _, load, capacity = app.scheduler.report(day, day)[0]
+    return DayLoad(day=day, load=load, capacity=capacity)
+
+
+@app.post('/schedule/rebalance', tags=['schedule'])
+async def rebalance_schedule():
+    """Reassign patients not vaccinated yet to the earliest days with free capacity starting from their preferred
+    dates. Returns number of moved vaccinations. New schedule is planned on threadpool from records saved before
+    rebalance started and applied by registration writer together with records saved meanwhile."""
+    if app.rebalancing:
+        raise HTTPException(status.HTTP_409_CONFLICT, detail='Schedule is already being rebalanced')
+
+    app.rebalancing = True
+    try:
+        last_id = await app.pipeline.run(lambda: len(app.patients))
+        plan = await run_in_threadpool(plan_rebalance, app.scheduler.copy(), last_id)
+        moved = plan[1]
+        if moved:
+            await app.pipeline.run(partial(apply_rebalance, plan, last_id))
+    finally:
+        app.rebalancing = False
+
+    return {'moved': len(moved)}
+
+
+def plan_rebalance(scheduler, last_id: int):
+    """Rebalance scheduler with patients up to last_id, save moved vaccination dates and return (scheduler, moved
+    patients, vaccination dates index, vaccinations counter) - run on threadpool."""
+    dates = array('i')
+
+    def patients():
+        for patient in islice(app.patients.scan(), last_id):
+            dates.append(patient.vaccination_date.toordinal())
+            yield (patient.id, patient.vaccination_date,
+                   patient.register_date + timedelta(days=count_letters(patient.name + patient.surname)))
+
+    moved = scheduler.rebalance(patients(), date.today())
+    if not moved:
+        return scheduler, moved, None, None
+    for start in range(0, len(moved), BATCH_CHUNK_SIZE):
+        app.patients.update([app.patients.get(patient_id).copy(update={'vaccination_date': day})
+                             for patient_id, day in moved[start:start + BATCH_CHUNK_SIZE]])
+    for patient_id, day in moved:
+        dates[patient_id - 1] = day.toordinal()
+    index = SortedIndex()
+    for patient_id, day in enumerate(dates, 1):
+        index.add(date.fromordinal(day), patient_id)
+    vaccinations = DayCounter()
+    for day, count in scheduler.load.items():
+        vaccinations.add(date.fromordinal(day), count)
+    return scheduler, moved, index, vaccinations
+
+
+def apply_rebalance(plan: tuple, last_id: int):
+    """Add patients saved after last_id to planned schedule, index and counter and replace current ones - run by
+    registration writer between batches."""
+    scheduler, moved, index, vaccinations = plan
+    for patient in app.patients.scan(last_id):
+        scheduler.book(patient.vaccination_date)
+        index.add(patient.vaccination_date, patient.id)
+        vaccinations.add(patient.vaccination_date)
+    scheduler.set_capacities(app.scheduler.capacities)
+    app.scheduler, app.index.vaccination_dates, app.stats.vaccinations = scheduler, index, vaccinations
+    logger.info('schedule_rebalanced', extra={'moved': len(moved)})
+
+
+@app.get('/stats', response_model=Stats, tags=['schedule'])
+async def read_stats(date_from: date = None, date_to: date = None, daily: bool = False):
+    """Return number of registrations and scheduled vaccinations in given range (30 days before and after today by
+    default), optionally for every day, and totals of all patients."""
+    today = date.today()
+    date_from = date_from or today - timedelta(days=30)
+    date_to = date_to or today + timedelta(days=30)
+    if date_to < date_from or (daily and (date_to - date_from).days > 3660):
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, detail='Invalid date range')
+
+    registrations, vaccinations = app.stats.registrations, app.stats.vaccinations
+    days = None
+    if daily:
+        days = [DayStats(day=day, registrations=registrations.get(day), vaccinations=vaccinations.get(day))
+                for day in (date_from + timedelta(days=offset) for offset in range((date_to - date_from).days + 1))]
+    return Stats(date_from=date_from, date_to=date_to, registrations=registrations.sum(date_from, date_to),
+                 vaccinations=vaccinations.sum(date_from, date_to), total_patients=len(app.stats),
+                 total_vaccinated=vaccinations.sum(last=today - timedelta(days=1)), days=days)
+
+
+@app.get('/metrics', response_class=PlainTextResponse, tags=['helpers'])
+async def read_metrics():
+    """Return request and domain metrics in Prometheus text format."""
+    return PlainTextResponse(metrics.render(), media_type='text/plain; version=0.0.4')
+
+
+@app.get('/hello', tags=['helpers'], response_class=HTMLResponse)
+async def read_html(request: Request):
     """Return simple HTML response."""
-    text = f'<html><body><h1>Hello! Today date is {date.today()}</h1></body></html>'
-    return HTMLResponse(text)
+    return cached_response(render_hello(date.today()), request, 'public, no-cache')
+
+
+@lru_cache(maxsize=2)
+def render_hello(today: date):
+    """Return HTML greeting with given date."""
+    return render_body(f'<html><body><h1>Hello! Today date is {today}</h1></body></html>', 'text/html')
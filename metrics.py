@@ -0,0 +1,126 @@
+from bisect import bisect_left
+from collections import defaultdict
+from time import perf_counter
+
+DURATION_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNTERS = {'patient_registrations_total': 'Number of registered patients.',
+            'login_attempts_total': 'Number of login attempts by key kind and result.',
+            'rejected_requests_total': 'Number of requests rejected by rate limiting and load shedding.'}
+
+
+class Histogram:
+    """Histogram with fixed buckets - counts are cumulated only when rendered."""
+
+    def __init__(self, buckets: tuple = DURATION_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        """Add value to the first bucket with upper bound not lower than value."""
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def render(self, name: str, labels: str):
+        """Yield Prometheus text format lines."""
+        total = 0
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            total += count
+            yield f'{name}_bucket{{{labels},le="{bound}"}} {total}'
+        yield f'{name}_sum{{{labels}}} {self.sum}'
+        yield f'{name}_count{{{labels}}} {total}'
+
+
+class Metrics:
+    """Application metrics - HTTP requests per route template and domain counters, rendered in Prometheus text
+    format."""
+
+    def __init__(self):
+        self.requests = defaultdict(int)
+        self.durations = defaultdict(Histogram)
+        self.in_flight = 0
+        self.counters = defaultdict(int)
+        self.collectors = []
+
+    def inc(self, name: str, value: int = 1, **labels):
+        """Increase domain counter with given labels."""
+        self.counters[name, tuple(labels.items())] += value
+
+    def observe(self, method: str, route: str, status_code: int, duration: float):
+        """Save finished HTTP request."""
+        self.requests[method, route, status_code // 100] += 1
+        self.durations[method, route].observe(duration)
+
+    def render(self):
+        """Return all metrics in Prometheus text format."""
+        lines = ['# HELP http_requests_total Number of HTTP requests by route and status class.',
+                 '# TYPE http_requests_total counter']
+        lines.extend(f'http_requests_total{{method="{method}",route="{escape(route)}",status="{status_class}xx"}} '
+                     f'{count}' for (method, route, status_class), count in sorted(self.requests.items()))
+        lines.extend(['# HELP http_requests_in_flight Number of HTTP requests being processed.',
+                      '# TYPE http_requests_in_flight gauge', f'http_requests_in_flight {self.in_flight}',
+                      '# HELP http_request_duration_seconds HTTP request latency by route.',
+                      '# TYPE http_request_duration_seconds histogram'])
+        for (method, route), histogram in sorted(self.durations.items()):
+            lines.extend(histogram.render('http_request_duration_seconds',
+                                          f'method="{method}",route="{escape(route)}"'))
+        for name, description in COUNTERS.items():
+            lines.extend([f'# HELP {name} {description}', f'# TYPE {name} counter'])
+            lines.extend(f'{name}{format_labels(labels)} {value}'
+                         for (counter, labels), value in sorted(self.counters.items()) if counter == name)
+        for collector in self.collectors:
+            lines.extend(collector())
+        return '\n'.join(lines) + '\n'
+
+
+class MetricsMiddleware:
+    """ASGI middleware saving count, status and latency of HTTP requests per route template."""
+
+    def __init__(self, app, metrics: Metrics):
+        self.app = app
+        self.metrics = metrics
+        self.templates = None
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message['type'] == 'http.response.start':
+                status_code = message['status']
+            await send(message)
+
+        self.metrics.in_flight += 1
+        start = perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            duration = perf_counter() - start
+            self.metrics.in_flight -= 1
+            self.metrics.observe(scope['method'], self.route(scope), status_code, duration)
+
+    def route(self, scope):
+        """Return template of route which handled request - router saves its endpoint in scope."""
+        if self.templates is None:
+            self.templates = {route.endpoint: route.path for route in scope['app'].routes
+                              if hasattr(route, 'endpoint')}
+        return self.templates.get(scope.get('endpoint'), '<unmatched>')
+
+
+def escape(value: str):
+    """Return label value escaped for Prometheus text format."""
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(labels: tuple):
+    """Return labels in Prometheus text format."""
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{escape(str(value))}"' for name, value in labels) + '}'
+
+
+metrics = Metrics()
@@ -1,6 +1,7 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from datetime import date
 from enum import Enum
+from typing import List, Optional
 
 
 class UnregisteredPatient(BaseModel):
@@ -12,12 +13,55 @@ class UnregisteredPatient(BaseModel):
 class Patient(UnregisteredPatient):
     """Patient registered for vaccination."""
     id: int = None
-    register_date: date = date.today()
+    register_date: date = Field(default_factory=date.today)
     vaccination_date: date = None
 
 
+class PatientPage(BaseModel):
+    """Page of patient records, next page starts after next_after_id."""
+    patients: List[Patient]
+    next_after_id: Optional[int] = None
+
+
+class DayLoad(BaseModel):
+    """Number of vaccinations scheduled on given day and its capacity (None if unlimited)."""
+    day: date
+    load: int
+    capacity: Optional[int] = None
+
+
+class DayStats(BaseModel):
+    """Number of registrations and scheduled vaccinations on given day."""
+    day: date
+    registrations: int
+    vaccinations: int
+
+
+class Stats(BaseModel):
+    """Number of registrations and scheduled vaccinations in date range and totals of all patients."""
+    date_from: date
+    date_to: date
+    registrations: int
+    vaccinations: int
+    total_patients: int
+    total_vaccinated: int
+    days: Optional[List[DayStats]] = None
+
+
+class PasswordPair(BaseModel):
+    """Password with hash to be verified."""
+    password: str
+    password_hash: str
+
+
 class FormatEnum(str, Enum):
     """HTTP response message format enumerator."""
     txt = 'txt'
     html = 'html'
     json = 'json'
+
+
+class ExportFormatEnum(str, Enum):
+    """Patient records export format enumerator."""
+    ndjson = 'ndjson'
+    csv = 'csv'
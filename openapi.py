@@ -0,0 +1,36 @@
+"""Prebuilt OpenAPI schema. Run as script to generate schema file served by application instead of building the schema
+on the first '/docs' or '/redoc' request (done on deploy by bin/post_compile):
+    $ python openapi.py openapi.json
+"""
+from fastapi import FastAPI
+from json import dump, load
+from os import environ
+from os.path import exists
+from sys import argv
+
+
+def prebuilt_openapi(app: FastAPI, path: str):
+    """Return replacement of app.openapi method loading schema from file once, schema is generated if file doesn't
+    exist."""
+
+    def openapi():
+        if app.openapi_schema is None and exists(path):
+            with open(path, encoding='utf8') as file:
+                app.openapi_schema = load(file)
+        return FastAPI.openapi(app)
+
+    return openapi
+
+
+def build_openapi(app: FastAPI, path: str):
+    """Generate schema of app and save it in file."""
+    app.openapi_schema = None
+    with open(path, 'w', encoding='utf8') as file:
+        dump(FastAPI.openapi(app), file, separators=(',', ':'))
+
+
+if __name__ == '__main__':
+    environ.setdefault('PATIENT_STORAGE', 'memory')
+    from main import app
+
+    build_openapi(app, argv[1] if len(argv) > 1 else 'openapi.json')
@@ -0,0 +1,97 @@
+from asyncio import ensure_future, get_event_loop, shield
+
+from indexes import duplicate_key
+
+
+class RegistrationPipeline:
+    """Registers patients by single writer task on event loop - records submitted while previous batch is committed
+    are saved together in the next batch (group commit). Ids are assigned by the writer right before records are saved,
+    so requests failing before submit or failed writes never leave gaps in ids. Patients are added to indexes and
+    statistics and requests waiting for them are woken up only after storage commits them. With duplicates indexed,
+    normalized names and surnames of queued patients are reserved until they are saved, so concurrent registrations of
+    the same patient wait for the first one."""
+
+    def __init__(self, storage, index, stats):
+        self.storage = storage
+        self.index = index
+        self.stats = stats
+        self.queue = []
+        self.operations = []
+        self.reserved = {}
+        self.writer = None
+
+    def submit(self, patients: list):
+        """Queue patients for writing and return future with the same patients when they are committed - ids are
+        assigned in order of submission."""
+        future = get_event_loop().create_future()
+        self.queue.append((patients, future))
+        if self.index.duplicates is not None:
+            for position, patient in enumerate(patients):
+                self.reserved.setdefault(duplicate_key(patient.name, patient.surname), (future, position))
+        self._start()
+        return future
+
+    def run(self, operation):
+        """Queue function called by writer between batches, when all saved records are committed and indexed, and
+        return future with its result - used to change saved records outside of registration."""
+        future = get_event_loop().create_future()
+        self.operations.append((operation, future))
+        self._start()
+        return future
+
+    async def find_duplicate(self, name: str, surname: str):
+        """Return saved or queued patient with the same normalized name and surname (waiting until it is saved) or
+        None if not found or duplicates are not indexed."""
+        patient_id = self.index.find_duplicate(name, surname)
+        if patient_id is not None:
+            return self.storage.get(patient_id)
+        reserved = self.reserved.get(duplicate_key(name, surname)) if self.reserved else None
+        if reserved is None:
+            return None
+        future, position = reserved
+        return (await shield(future))[position]
+
+    async def write(self):
+        """Run queued operations and save queued patients in batches until nothing is queued."""
+        try:
+            while self.queue or self.operations:
+                operations, self.operations = self.operations, []
+                for operation, future in operations:
+                    if not future.done():
+                        try:
+                            future.set_result(operation())
+                        except Exception as exc:
+                            future.set_exception(exc)
+                if self.queue:
+                    await self.write_batch()
+        finally:
+            self.writer = None
+
+    async def write_batch(self):
+        """Assign ids to all queued patients, save and commit them in single batch and wake up requests waiting for
+        them."""
+        queue, self.queue = self.queue, []
+        patients = [patient for batch, _ in queue for patient in batch]
+        for patient_id, patient in enumerate(patients, len(self.storage) + 1):
+            patient.id = patient_id
+        try:
+            self.storage.extend(patients)
+            await self.storage.commit()
+            self.index.extend(patients)
+            self.stats.extend(patients)
+        except Exception as exc:
+            for _, future in queue:
+                if not future.done():
+                    future.set_exception(exc)
+            return
+        finally:
+            futures = {future for _, future in queue}
+            self.reserved = {key: reserved for key, reserved in self.reserved.items() if reserved[0] not in futures}
+        for batch, future in queue:
+            if not future.done():
+                future.set_result(batch)
+
+    def _start(self):
+        """Start writer task if it is not running."""
+        if self.writer is None:
+            self.writer = ensure_future(self.write())
@@ -0,0 +1,136 @@
+from base64 import b64decode
+from binascii import Error as DecodingError
+from collections import OrderedDict
+from json import dumps
+from math import ceil
+from os import environ
+from time import monotonic
+from typing import NamedTuple
+
+from metrics import metrics
+
+
+class Limit(NamedTuple):
+    """Token bucket refilled with rate tokens per second up to burst tokens."""
+    rate: float
+    burst: float
+
+
+# routes limited also per username from Basic authorization header
+USERNAME_LIMITED = {'/login_session', '/login_token'}
+
+
+class TokenBuckets:
+    """Token buckets of at most capacity clients - the least recently seen client is forgotten when store is full,
+    which is the same as giving it full bucket."""
+
+    def __init__(self, limit: Limit, capacity: int = 100000):
+        self.limit = limit
+        self.capacity = capacity
+        self.buckets = OrderedDict()
+
+    def __len__(self):
+        return len(self.buckets)
+
+    def take(self, key) -> float:
+        """Take one token from client's bucket and return 0 or return seconds until token is available if bucket is
+        empty."""
+        now = monotonic()
+        tokens, updated = self.buckets.pop(key, (self.limit.burst, now))
+        tokens = min(self.limit.burst, tokens + (now - updated) * self.limit.rate)
+        wait = 0.0
+        if tokens < 1:
+            wait = (1 - tokens) / self.limit.rate
+        else:
+            tokens -= 1
+        self.buckets[key] = (tokens, now)
+        if len(self.buckets) > self.capacity:
+            self.buckets.popitem(last=False)
+        return wait
+
+
+class RateLimitMiddleware:
+    """ASGI middleware rejecting requests with 429 response when client's IP or username token bucket of route is
+    empty and with 503 response when more than max_concurrency requests are processed."""
+
+    def __init__(self, app, limits: dict, max_concurrency: int = None, capacity: int = 100000):
+        self.app = app
+        self.max_concurrency = max_concurrency
+        self.in_flight = 0
+        self.buckets = {path: {'ip': TokenBuckets(limit, capacity), 'username': TokenBuckets(limit, capacity)}
+                        for path, limit in limits.items()}
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        if self.max_concurrency is not None and self.in_flight >= self.max_concurrency:
+            metrics.inc('rejected_requests_total', reason='overload')
+            await reject(send, 503, 'Service overloaded', 1)
+            return
+        buckets = self.buckets.get(scope['path'])
+        if buckets is not None:
+            wait = self.wait(buckets, scope)
+            if wait:
+                metrics.inc('rejected_requests_total', reason='rate_limit')
+                await reject(send, 429, 'Too many requests', wait)
+                return
+
+        self.in_flight += 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.in_flight -= 1
+
+    def wait(self, buckets: dict, scope) -> float:
+        """Return seconds client has to wait or 0 if request is allowed."""
+        client = scope.get('client')
+        wait = buckets['ip'].take(client[0] if client else '')
+        if not wait and scope['path'] in USERNAME_LIMITED:
+            username = basic_username(scope)
+            if username is not None:
+                wait = buckets['username'].take(username)
+        return wait
+
+
+async def reject(send, status_code: int, detail: str, retry_after: float):
+    """Send JSON error response with Retry-After header."""
+    body = dumps({'detail': detail}).encode()
+    await send({'type': 'http.response.start', 'status': status_code,
+                'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode()),
+                            (b'retry-after', str(ceil(retry_after)).encode())]})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+def basic_username(scope):
+    """Return username from Basic authorization header or None."""
+    for name, value in scope['headers']:
+        if name == b'authorization':
+            scheme, _, credentials = value.partition(b' ')
+            if scheme.lower() != b'basic':
+                return None
+            try:
+                return b64decode(credentials).partition(b':')[0]
+            except (DecodingError, ValueError):
+                return None
+    return None
+
+
+def parse_limits(text: str):
+    """Return {path: limit} dictionary parsed from 'path=rate:burst,path=rate:burst' text."""
+    limits = {}
+    for item in filter(None, text.split(',')):
+        path, limit = item.split('=')
+        rate, burst = limit.split(':')
+        limits[path.strip()] = Limit(float(rate), float(burst))
+    return limits
+
+
+def rate_limit_options():
+    """Return middleware options configured with RATE_LIMITS ('path=rate:burst,...', routes are not limited by
+    default), RATE_LIMIT_CLIENTS (remembered clients per route) and MAX_CONCURRENCY variables."""
+    max_concurrency = environ.get('MAX_CONCURRENCY')
+    return {'limits': parse_limits(environ.get('RATE_LIMITS', '')),
+            'max_concurrency': max_concurrency and int(max_concurrency),
+            'capacity': int(environ.get('RATE_LIMIT_CLIENTS', 100000))}
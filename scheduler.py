@@ -0,0 +1,106 @@
+from array import array
+from datetime import date
+from os import environ
+
+
+class Scheduler:
+    """Vaccination slots scheduler - assigns patients to the earliest day with free capacity. Full days point to the
+    next day which may have free slots (disjoint-set with path compression), so assignment takes nearly constant time
+    regardless of number of full days."""
+
+    def __init__(self, default_capacity: int = None):
+        self.default_capacity = default_capacity
+        self.capacities = {}
+        self.load = {}
+        self.next_free = {}
+
+    def capacity(self, day: int):
+        """Return capacity of day given as ordinal or None if unlimited."""
+        return self.capacities.get(day, self.default_capacity)
+
+    def assign(self, day: date) -> date:
+        """Book slot on the earliest day with free capacity starting from given day and return it."""
+        return date.fromordinal(self._book(self._find(day.toordinal())))
+
+    def book(self, day: date):
+        """Book slot on given day even if it is full (used to load existing patients)."""
+        self._book(day.toordinal())
+
+    def set_capacity(self, day: date, capacity: int = None):
+        """Change capacity of given day, None restores default capacity."""
+        day = day.toordinal()
+        if capacity is None:
+            self.capacities.pop(day, None)
+        else:
+            self.capacities[day] = capacity
+        self._mark_full_days()
+
+    def set_capacities(self, capacities: dict):
+        """Replace capacities of all days (keyed by day ordinals)."""
+        self.capacities = dict(capacities)
+        self._mark_full_days()
+
+    def copy(self):
+        """Return scheduler with the same capacities and without booked slots."""
+        scheduler = Scheduler(self.default_capacity)
+        scheduler.set_capacities(self.capacities)
+        return scheduler
+
+    def report(self, first: date, last: date):
+        """Return list of (day, load, capacity) tuples for every day in given range."""
+        return [(date.fromordinal(day), self.load.get(day, 0), self.capacity(day))
+                for day in range(first.toordinal(), last.toordinal() + 1)]
+
+    def rebalance(self, patients, today: date):
+        """Reassign not yet vaccinated patients to the earliest days with free capacity starting from their preferred
+        days (given as (patient_id, vaccination_date, preferred_day) tuples in registration order). Returns list of
+        (patient_id, new_date) pairs of patients with changed vaccination date. Reassigned patients are kept in arrays,
+        so millions of them don't create objects freed at once."""
+        self.load, moved = {}, []
+        pending_ids, pending_dates, preferred_dates = array('q'), array('i'), array('i')
+        self._mark_full_days()
+        today = today.toordinal()
+        for patient_id, vaccination_date, preferred_day in patients:
+            vaccination_date = vaccination_date.toordinal()
+            if vaccination_date < today:
+                self._book(vaccination_date)
+            else:
+                pending_ids.append(patient_id)
+                pending_dates.append(vaccination_date)
+                preferred_dates.append(max(preferred_day.toordinal(), today))
+        for patient_id, vaccination_date, preferred_day in zip(pending_ids, pending_dates, preferred_dates):
+            day = self._book(self._find(preferred_day))
+            if day != vaccination_date:
+                moved.append((patient_id, date.fromordinal(day)))
+        return moved
+
+    def _find(self, day: int) -> int:
+        """Return the earliest day with free capacity starting from given day."""
+        root = day
+        while root in self.next_free:
+            root = self.next_free[root]
+        while day != root:
+            self.next_free[day], day = root, self.next_free[day]
+        return root
+
+    def _book(self, day: int) -> int:
+        """Increase load of given day and mark it full if needed."""
+        self.load[day] = self.load.get(day, 0) + 1
+        if self._is_full(day):
+            self.next_free[day] = day + 1
+        return day
+
+    def _mark_full_days(self):
+        """Rebuild pointers of full days after capacity or load change."""
+        self.next_free = {day: day + 1 for day in self.load.keys() | self.capacities.keys() if self._is_full(day)}
+
+    def _is_full(self, day: int):
+        """Return True if load of given day reached its capacity."""
+        capacity = self.capacity(day)
+        return capacity is not None and self.load.get(day, 0) >= capacity
+
+
+def create_scheduler():
+    """Return scheduler with default daily capacity configured with DAILY_CAPACITY variable (unlimited if not set)."""
+    capacity = environ.get('DAILY_CAPACITY')
+    return Scheduler(None if capacity is None else int(capacity))
@@ -0,0 +1,88 @@
+from datetime import date
+
+
+class DayCounter:
+    """Counts per day with sums over any range of days in O(log n) - Fenwick tree over days since origin. Tree is
+    rebuilt with doubled size when day outside covered range is counted."""
+
+    def __init__(self, size: int = 1024):
+        self.counts = {}
+        self.total = 0
+        self.origin = None
+        self.tree = [0] * (size + 1)
+
+    def add(self, day: date, value: int = 1):
+        """Add value to count of given day."""
+        day = day.toordinal()
+        if self.origin is None:
+            self.origin = day
+        if not self.origin <= day < self.origin + len(self.tree) - 1:
+            self._rebuild(day)
+        self.counts[day] = self.counts.get(day, 0) + value
+        self.total += value
+        position = day - self.origin + 1
+        while position < len(self.tree):
+            self.tree[position] += value
+            position += position & -position
+
+    def get(self, day: date) -> int:
+        """Return count of given day."""
+        return self.counts.get(day.toordinal(), 0)
+
+    def sum(self, first: date = None, last: date = None) -> int:
+        """Return sum of counts of days between first and last (inclusive, unbounded if None)."""
+        start = self._prefix(first.toordinal() - 1) if first is not None else 0
+        end = self._prefix(last.toordinal()) if last is not None else self.total
+        return max(end - start, 0)
+
+    def _prefix(self, day: int) -> int:
+        """Return sum of counts of days up to given ordinal."""
+        if self.origin is None or day < self.origin:
+            return 0
+        position = min(day - self.origin + 1, len(self.tree) - 1)
+        result = 0
+        while position > 0:
+            result += self.tree[position]
+            position -= position & -position
+        return result
+
+    def _rebuild(self, day: int):
+        """Move origin and grow tree until it covers given day, then fill it with saved counts in linear time."""
+        origin, size = min(self.origin, day), len(self.tree) - 1
+        while max(self.counts.keys() | {day}) >= origin + size:
+            size *= 2
+        tree = [0] * (size + 1)
+        for counted_day, count in self.counts.items():
+            tree[counted_day - origin + 1] += count
+        for position in range(1, size + 1):
+            parent = position + (position & -position)
+            if parent <= size:
+                tree[parent] += tree[position]
+        self.origin, self.tree = origin, tree
+
+
+class PatientStats:
+    """Aggregates of patient records updated on every saved record - registrations per register date and scheduled
+    vaccinations per vaccination date."""
+
+    def __init__(self):
+        self.registrations = DayCounter()
+        self.vaccinations = DayCounter()
+
+    def __len__(self):
+        return self.registrations.total
+
+    def add(self, patient):
+        """Count new patient."""
+        self.registrations.add(patient.register_date)
+        self.vaccinations.add(patient.vaccination_date)
+
+    def extend(self, patients):
+        """Count new patients."""
+        for patient in patients:
+            self.add(patient)
+
+    def move(self, old_date: date, new_date: date):
+        """Move scheduled vaccination to another day."""
+        self.vaccinations.add(old_date, -1)
+        self.vaccinations.add(new_date)
@@ -0,0 +1,253 @@
+from array import array
+from asyncio import sleep
+from datetime import date
+from os import environ
+from threading import Event, Lock, Thread
+from time import monotonic
+
+from starlette.concurrency import run_in_threadpool
+
+from models import Patient
+from utils import logger
+
+
+class StringPool:
+    """Interned strings referenced by integer codes, so repeated names are kept in memory once."""
+
+    def __init__(self):
+        self.strings = []
+        self.codes = {}
+
+    def __len__(self):
+        return len(self.strings)
+
+    def encode(self, text: str) -> int:
+        """Return code of text, new texts get next code."""
+        code = self.codes.get(text)
+        if code is None:
+            code = self.codes[text] = len(self.strings)
+            self.strings.append(text)
+        return code
+
+
+class MemoryStorage:
+    """Patient records kept in process memory as compact table - names and surnames are interned string codes, dates
+    are day ordinals in arrays and ids are implicit by position. Patient objects are built only when records are
+    read."""
+
+    def __init__(self):
+        self.strings = StringPool()
+        self.names = array('I')
+        self.surnames = array('I')
+        self.register_dates = array('i')
+        self.vaccination_dates = array('i')
+
+    def __len__(self):
+        return len(self.names)
+
+    def append(self, patient: Patient):
+        """Save patient with next id. Names column is written last, so readers on other threads see only complete
+        rows."""
+        self.surnames.append(self.strings.encode(patient.surname))
+        self.register_dates.append(patient.register_date.toordinal())
+        self.vaccination_dates.append(patient.vaccination_date.toordinal())
+        self.names.append(self.strings.encode(patient.name))
+
+    def extend(self, patients: list):
+        """Save patients with contiguous ids (names column is written last as in append)."""
+        encode = self.strings.encode
+        self.surnames.extend(encode(patient.surname) for patient in patients)
+        self.register_dates.extend(patient.register_date.toordinal() for patient in patients)
+        self.vaccination_dates.extend(patient.vaccination_date.toordinal() for patient in patients)
+        self.names.extend(encode(patient.name) for patient in patients)
+
+    def update(self, patients: list):
+        """Replace saved patients with given records with the same ids."""
+        for patient in patients:
+            position = patient.id - 1
+            self.surnames[position] = self.strings.encode(patient.surname)
+            self.register_dates[position] = patient.register_date.toordinal()
+            self.vaccination_dates[position] = patient.vaccination_date.toordinal()
+            self.names[position] = self.strings.encode(patient.name)
+
+    def get(self, patient_id: int):
+        """Return patient with given id or None if not found."""
+        if 0 < patient_id <= len(self.names):
+            return self._to_patient(patient_id - 1)
+        return None
+
+    def scan(self, after_id: int = 0):
+        """Yield patients with id greater than after_id in ascending id order."""
+        for position in range(after_id, len(self.names)):
+            yield self._to_patient(position)
+
+    async def commit(self):
+        """Nothing to commit - records are saved by extend."""
+
+    def close(self):
+        """Nothing to release."""
+
+    def _to_patient(self, position: int):
+        """Return patient built from table row."""
+        strings = self.strings.strings
+        return Patient.construct(name=strings[self.names[position]], surname=strings[self.surnames[position]],
+                                 id=position + 1, register_date=date.fromordinal(self.register_dates[position]),
+                                 vaccination_date=date.fromordinal(self.vaccination_dates[position]))
+
+
+class SQLiteStorage:
+    """Patient records kept in SQLite database in WAL mode. Writes are buffered and committed in groups - when awaited
+    commit is called, by background thread every commit_interval seconds or once commit_size records are pending.
+    sqlite3 module is imported only when this storage is used."""
+
+    def __init__(self, path: str, commit_interval: float = 0.05, commit_size: int = 10000):
+        import sqlite3
+        self.commit_interval = commit_interval
+        self.commit_size = commit_size
+        self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS patients (id INTEGER PRIMARY KEY, name TEXT NOT NULL, '
+                                'surname TEXT NOT NULL, register_date TEXT NOT NULL, vaccination_date TEXT NOT NULL)')
+        self.committed = self.connection.execute('SELECT COALESCE(MAX(id), 0) FROM patients').fetchone()[0]
+        self.pending = []
+        self.lock = Lock()
+        self.last_commit = monotonic()
+        self.closed = Event()
+        self.flusher = Thread(target=self._flush_periodically, name='sqlite-storage-flusher', daemon=True)
+        self.flusher.start()
+
+    def __len__(self):
+        return self.committed + len(self.pending)
+
+    def append(self, patient: Patient):
+        """Save patient with next id."""
+        self.extend([patient])
+
+    def extend(self, patients: list):
+        """Save patients with contiguous ids."""
+        with self.lock:
+            self.pending.extend(patients)
+            if len(self.pending) >= self.commit_size:
+                self._commit()
+
+    def update(self, patients: list):
+        """Replace saved patients with given records with the same ids."""
+        with self.lock:
+            committed = [patient for patient in patients if patient.id <= self.committed]
+            for patient in patients:
+                if patient.id > self.committed:
+                    self.pending[patient.id - self.committed - 1] = patient
+            with self.connection:
+                self.connection.execute('BEGIN')
+                self.connection.executemany('UPDATE patients SET name = ?, surname = ?, register_date = ?, '
+                                            'vaccination_date = ? WHERE id = ?',
+                                            [(patient.name, patient.surname, patient.register_date.isoformat(),
+                                              patient.vaccination_date.isoformat(), patient.id)
+                                             for patient in committed])
+
+    def get(self, patient_id: int):
+        """Return patient with given id or None if not found."""
+        with self.lock:
+            if self.committed < patient_id <= self.committed + len(self.pending):
+                return self.pending[patient_id - self.committed - 1]
+            row = self.connection.execute('SELECT name, surname, id, register_date, vaccination_date FROM patients '
+                                          'WHERE id = ?', (patient_id,)).fetchone()
+        if row is None:
+            return None
+        return self._to_patient(row)
+
+    def scan(self, after_id: int = 0, chunk_size: int = 1000):
+        """Yield patients with id greater than after_id in ascending id order."""
+        while True:
+            with self.lock:
+                rows = self.connection.execute('SELECT name, surname, id, register_date, vaccination_date '
+                                               'FROM patients WHERE id > ? ORDER BY id LIMIT ?',
+                                               (after_id, chunk_size)).fetchall()
+                if not rows:
+                    pending = self.pending[max(after_id - self.committed, 0):]
+            if not rows:
+                yield from pending
+                return
+            yield from map(self._to_patient, rows)
+            after_id = rows[-1][2]
+
+    def flush(self):
+        """Commit all pending records."""
+        with self.lock:
+            self._commit()
+
+    async def commit(self):
+        """Commit all pending records without blocking event loop. Transient errors (e.g. locked database) are logged
+        and retried, other errors are raised after pending records are dropped."""
+        import sqlite3
+        saved = len(self)
+        while True:
+            try:
+                await run_in_threadpool(self.flush)
+            except sqlite3.OperationalError:
+                logger.exception('storage_commit_failed', extra={'pending': len(self.pending)})
+                await sleep(self.commit_interval)
+                continue
+            if self.committed < saved:
+                raise sqlite3.DatabaseError('Pending records were dropped after failed commit')
+            return
+
+    def close(self):
+        """Commit pending records and close database."""
+        self.closed.set()
+        self.flusher.join()
+        self.flush()
+        self.connection.close()
+
+    def _commit(self):
+        """Write pending records in single transaction - has to be called with lock acquired. Records are kept pending
+        after transient error and dropped after other errors (e.g. ids already used), which would fail every retry."""
+        import sqlite3
+        if self.pending:
+            try:
+                with self.connection:
+                    self.connection.execute('BEGIN')
+                    self.connection.executemany('INSERT INTO patients VALUES (?, ?, ?, ?, ?)',
+                                                [(patient.id, patient.name, patient.surname,
+                                                  patient.register_date.isoformat(),
+                                                  patient.vaccination_date.isoformat())
+                                                 for patient in self.pending])
+            except sqlite3.OperationalError:
+                raise
+            except sqlite3.Error:
+                self.pending = []
+                raise
+            self.committed += len(self.pending)
+            self.pending = []
+        self.last_commit = monotonic()
+
+    @staticmethod
+    def _to_patient(row: tuple):
+        """Return patient built from database row."""
+        return Patient.construct(name=row[0], surname=row[1], id=row[2], register_date=date.fromisoformat(row[3]),
+                                 vaccination_date=date.fromisoformat(row[4]))
+
+    def _flush_periodically(self):
+        """Commit pending records every commit_interval seconds until storage is closed - failed commits are logged and
+        retried after transient errors."""
+        import sqlite3
+        while not self.closed.wait(self.commit_interval):
+            if self.pending and monotonic() - self.last_commit >= self.commit_interval:
+                pending = len(self.pending)
+                try:
+                    self.flush()
+                except sqlite3.OperationalError:
+                    logger.exception('storage_commit_failed', extra={'pending': pending})
+                except sqlite3.Error:
+                    logger.exception('storage_records_dropped', extra={'dropped': pending})
+
+
+def create_storage():
+    """Return patient storage configured with PATIENT_STORAGE ('sqlite' or 'memory') and DATABASE_PATH variables."""
+    backend = environ.get('PATIENT_STORAGE', 'sqlite')
+    if backend == 'memory':
+        return MemoryStorage()
+    elif backend == 'sqlite':
+        return SQLiteStorage(environ.get('DATABASE_PATH', 'patients.db'))
+    raise ValueError(f'Unknown patient storage: {backend}')
@@ -1,10 +1,36 @@
 import pytest
+from asyncio import gather, get_event_loop
+from fastapi import HTTPException
 from fastapi.testclient import TestClient
 from hashlib import sha512
 from datetime import date, timedelta
 from os import environ
-
-from main import app
+from io import StringIO
+from logging import getLogger
+from time import sleep
+from sys import getswitchinterval, setswitchinterval
+from threading import Event, Thread
+from json import dumps, loads
+import sqlite3
+
+environ['PATIENT_STORAGE'] = 'memory'
+
+from main import app, export_patient_records
+from models import ExportFormatEnum, Patient
+from storage import MemoryStorage, SQLiteStorage
+from log import setup_logging
+from hashing import PasswordHasher, hash_password
+from scheduler import Scheduler
+from keystore import SessionCache, SQLiteKeyStore, SignedKeyStore, create_key_store
+import keystore
+from credentials import CredentialStore
+from ratelimit import Limit, RateLimitMiddleware
+from idempotency import IdempotencyMiddleware, ResponseCache
+from indexes import PatientIndex
+from pipeline import RegistrationPipeline
+from stats import DayCounter, PatientStats
+from openapi import build_openapi, prebuilt_openapi
+from utils import iter_json_records
 
 
 @pytest.fixture
@@ -72,6 +98,306 @@ def test_auth(client):
         assert response.status_code == 401
 
 
+def test_auth_batch(client):
+    """Test verification of many SHA-512 and salted hashes in '/auth/batch' endpoint."""
+    test_path = '/auth/batch'
+    pbkdf2_hash = hash_password('haslo', 'pbkdf2_sha256', (1000,))
+    scrypt_hash = hash_password('haslo', 'scrypt', (1024, 8, 1))
+    pairs = [{'password': 'haslo', 'password_hash': sha512('haslo'.encode('utf8')).hexdigest()},
+             {'password': 'haslo', 'password_hash': pbkdf2_hash},
+             {'password': 'inne_haslo', 'password_hash': pbkdf2_hash},
+             {'password': 'haslo', 'password_hash': scrypt_hash},
+             {'password': 'haslo', 'password_hash': 'pbkdf2_sha256$invalid'},
+             {'password': '', 'password_hash': ''}]
+    malformed = ['pbkdf2_sha256$s$h', 'pbkdf2_sha256$99999999999$s$h', 'pbkdf2_sha256$2000000000$s$h',
+                 'pbkdf2_sha256$0$s$h', 'scrypt$1048576$8$1$s$h', 'scrypt$1024$8$s$h', 'md5$1$s$h']
+    pairs += [{'password': 'haslo', 'password_hash': password_hash} for password_hash in malformed]
+
+    response = client.post(test_path, json=pairs)
+    response_single = client.get('/auth', params={'password': 'haslo', 'password_hash': scrypt_hash})
+    response_too_large = client.post(test_path, json=pairs * 200)
+
+    assert response.status_code == 200
+    assert response.json() == {'results': [True, True, False, True, False, False] + [False] * len(malformed)}
+    assert response_single.status_code == 204
+    assert response_too_large.status_code == 413
+
+
+def test_password_hasher_saturation():
+    """Test rejecting verifications when password hasher queue is full."""
+    hasher = PasswordHasher(workers=1, max_pending=1)
+    pairs = [('haslo', hash_password('haslo', 'pbkdf2_sha256', (1000,)))] * 2
+
+    with pytest.raises(HTTPException) as exc_info:
+        get_event_loop().run_until_complete(hasher.verify_many(pairs))
+
+    assert exc_info.value.status_code == 503
+    assert exc_info.value.headers == {'Retry-After': '1'}
+    assert hasher.pending == 0
+
+
+def test_credential_store(tmp_path):
+    """Test verifying users from credentials file, caching successful verifications and reloading changed file."""
+    path = tmp_path / 'credentials'
+    path.write_text(f'# operators\nadmin:{hash_password("secret", "pbkdf2_sha256", (1000,))}\n'
+                    f'nurse:{sha512("haslo".encode("utf8")).hexdigest()}\n')
+    store = CredentialStore(str(path), reload_interval=0)
+    verify = get_event_loop().run_until_complete
+
+    assert len(store) == 2
+    assert verify(store.verify('admin', 'secret'))
+    assert verify(store.verify('admin', 'secret'))
+    assert len(store.cache) == 1
+    assert verify(store.verify('nurse', 'haslo'))
+    assert not verify(store.verify('admin', 'haslo'))
+    assert not verify(store.verify('unknown', 'secret'))
+
+    path.write_text(f'admin:{hash_password("new_secret", "pbkdf2_sha256", (1000,))}\n')
+
+    assert not verify(store.verify('admin', 'secret'))
+    assert verify(store.verify('admin', 'new_secret'))
+    assert not verify(store.verify('nurse', 'haslo'))
+
+    path.write_text('admin without separator\n')
+    assert verify(store.verify('admin', 'new_secret'))
+    path.unlink()
+    assert verify(store.verify('admin', 'new_secret'))
+
+
+def test_rate_limit():
+    """Test rejecting requests when client's IP or username bucket is empty and when too many requests are
+    processed."""
+    async def application(scope, receive, send):
+        await send({'type': 'http.response.start', 'status': 200, 'headers': []})
+        await send({'type': 'http.response.body', 'body': b''})
+
+    limited = RateLimitMiddleware(application, {'/login_token': Limit(0.001, 2)}, capacity=1)
+    limited_client = TestClient(limited)
+    responses = [limited_client.post('/login_token', auth=('admin', 'secret')) for _ in range(3)]
+    response_other_route = limited_client.get('/')
+    limited.buckets['/login_token']['ip'].buckets.clear()
+    response_same_username = limited_client.post('/login_token', auth=('admin', 'secret'))
+    response_other_username = limited_client.post('/login_token', auth=('nurse', 'secret'))
+    overloaded = RateLimitMiddleware(application, {}, max_concurrency=0)
+    response_overloaded = TestClient(overloaded).get('/')
+
+    assert [response.status_code for response in responses] == [200, 200, 429]
+    assert int(responses[2].headers['Retry-After']) > 900
+    assert response_other_route.status_code == 200
+    assert response_same_username.status_code == 429
+    assert response_other_username.status_code == 200
+    assert len(limited.buckets['/login_token']['username']) == 1
+    assert response_overloaded.status_code == 503
+    assert response_overloaded.headers['Retry-After'] == '1'
+
+
+def test_idempotency():
+    """Test replaying saved response to request repeated with the same Idempotency-Key."""
+    calls = []
+
+    async def application(scope, receive, send):
+        calls.append((await receive())['body'])
+        status_code = 201 if len(calls) < 4 else 422
+        await send({'type': 'http.response.start', 'status': status_code, 'headers': [(b'x-call', b'%d' % len(calls))]})
+        await send({'type': 'http.response.body', 'body': b'{"id":%d}' % len(calls)})
+
+    idempotent_client = TestClient(IdempotencyMiddleware(application, {'/register'}, capacity=2))
+    first = idempotent_client.post('/register', headers={'Idempotency-Key': 'a'}, data=b'{"name":"Jan"}')
+    retry = idempotent_client.post('/register', headers={'Idempotency-Key': 'a'}, data=b'{"name":"Jan"}')
+    other_key = idempotent_client.post('/register', headers={'Idempotency-Key': 'b'})
+    no_key = idempotent_client.post('/register')
+    failed = idempotent_client.post('/register', headers={'Idempotency-Key': 'c'})
+    failed_retry = idempotent_client.post('/register', headers={'Idempotency-Key': 'c'})
+    too_long = idempotent_client.post('/register', headers={'Idempotency-Key': 'a' * 256})
+    other_body = idempotent_client.post('/register', headers={'Idempotency-Key': 'a'}, data=b'{"name":"Anna"}')
+
+    assert first.status_code == retry.status_code == 201
+    assert retry.json() == first.json() == {'id': 1}
+    assert retry.headers['x-call'] == '1'
+    assert retry.headers['idempotent-replayed'] == 'true'
+    assert other_key.json() == {'id': 2}
+    assert no_key.json() == {'id': 3}
+    assert failed.status_code == failed_retry.status_code == 422
+    assert failed_retry.json() == {'id': 5}
+    assert too_long.status_code == 400
+    assert other_body.status_code == 422
+    assert len(calls) == 5 and calls[0] == b'{"name":"Jan"}'
+
+
+def test_idempotency_without_ttl():
+    """Test not replaying responses when they expire immediately."""
+    cache = ResponseCache(ttl=0)
+    cache.set('a', b'response')
+
+    assert len(cache) == 0
+    assert cache.get('a') is None
+
+
+def test_duplicate_index():
+    """Test finding patients registered with the same normalized name and surname."""
+    index = PatientIndex(deduplicate=True)
+    index.extend([Patient(name='Jan', surname='Nowak', id=1, vaccination_date=date.today()),
+                  Patient(name='jan ', surname='NOWAK', id=2, vaccination_date=date.today())])
+
+    assert index.find_duplicate(' JAN', 'nowak') == 1
+    assert index.find_duplicate('Anna', 'Nowak') is None
+    assert PatientIndex().find_duplicate('Jan', 'Nowak') is None
+
+
+def test_patient_index_search():
+    """Test searching short and long prefixes and date ranges after given id."""
+    index = PatientIndex()
+    surnames = ['Nowak', 'Kowal', 'Kowalski', 'Nowicki', 'Kot', 'K']
+    index.extend([Patient(name='Jan', surname=surname, id=patient_id,
+                          vaccination_date=date.today() + timedelta(days=patient_id))
+                  for patient_id, surname in enumerate(surnames, 1)])
+
+    assert list(index.search(surname='k', prefix=True)[0]) == [2, 3, 5, 6]
+    assert list(index.search(surname='ko', prefix=True, after_id=2)[0]) == [3, 5]
+    assert list(index.search(surname='kow', prefix=True)[0]) == [2, 3]
+    assert list(index.search(surname='', prefix=True, after_id=4)[0]) == [5, 6]
+    assert list(index.search(surname='x', prefix=True)[0]) == []
+    assert list(index.search(surname='kowal')[0]) == [2]
+    assert list(index.search(vaccination_from=date.today() + timedelta(days=2), after_id=3)[0]) == [4, 5, 6]
+
+
+def test_registration_pipeline():
+    """Test allocating unique ids to concurrent registrations and saving them in single batch."""
+    storage = MemoryStorage()
+    storage.append(Patient(name='Jan', surname='Nowak', id=1, vaccination_date=date.today()))
+    pipeline = RegistrationPipeline(storage, PatientIndex(), PatientStats())
+    writes = []
+    storage_extend = storage.extend
+    storage.extend = lambda patients: writes.append(len(patients)) or storage_extend(patients)
+
+    async def register(name: str):
+        patient, = await pipeline.submit([Patient(name=name, surname='Nowak', vaccination_date=date.today())])
+        return patient.id
+
+    async def register_all():
+        return await gather(*(register(f'Anna{number}') for number in range(256)))
+
+    ids = get_event_loop().run_until_complete(register_all())
+
+    assert sorted(ids) == list(range(2, 258))
+    assert writes == [256]
+    assert [patient.id for patient in storage.scan()] == list(range(1, 258))
+    assert list(pipeline.index.search(name='anna255')[0]) == [257]
+
+
+def test_registration_pipeline_duplicates():
+    """Test returning queued patient to concurrent registrations of the same patient."""
+    pipeline = RegistrationPipeline(MemoryStorage(), PatientIndex(deduplicate=True), PatientStats())
+
+    async def register(name: str, surname: str):
+        duplicate = await pipeline.find_duplicate(name, surname)
+        if duplicate is not None:
+            return duplicate.id
+        patient, = await pipeline.submit([Patient(name=name, surname=surname, vaccination_date=date.today())])
+        return patient.id
+
+    async def register_all():
+        return await gather(register('Jan', 'Nowak'), register('jan', 'NOWAK '), register('Anna', 'Nowak'),
+                            register('Jan', 'Nowak'))
+
+    assert get_event_loop().run_until_complete(register_all()) == [1, 1, 2, 1]
+    assert get_event_loop().run_until_complete(register('JAN', 'Nowak')) == 1
+    assert len(pipeline.storage) == 2
+    assert pipeline.reserved == {}
+
+
+def test_registration_pipeline_failed_write():
+    """Test assigning next ids after failed write without leaving gaps."""
+    storage = MemoryStorage()
+    pipeline = RegistrationPipeline(storage, PatientIndex(), PatientStats())
+    storage_extend = storage.extend
+    storage.extend = lambda patients: (_ for _ in ()).throw(OSError('disk full'))
+
+    async def register(name: str):
+        patient, = await pipeline.submit([Patient(name=name, surname='Nowak', vaccination_date=date.today())])
+        return patient
+
+    with pytest.raises(OSError):
+        get_event_loop().run_until_complete(register('Jan'))
+    storage.extend = storage_extend
+    patient = get_event_loop().run_until_complete(register('Anna'))
+
+    assert patient.id == 1
+    assert storage.get(1) == patient
+    assert list(pipeline.index.search(name='anna')[0]) == [1]
+
+
+def test_registration_pipeline_run():
+    """Test running operation between batches when saved records are committed and indexed."""
+    storage = MemoryStorage()
+    pipeline = RegistrationPipeline(storage, PatientIndex(), PatientStats())
+
+    async def register_and_run():
+        future = pipeline.submit([Patient(name='Jan', surname='Nowak', vaccination_date=date.today())])
+        saved = await pipeline.run(lambda: (len(storage), len(pipeline.stats)))
+        await future
+        return saved, await pipeline.run(lambda: (len(storage), len(pipeline.stats)))
+
+    assert get_event_loop().run_until_complete(register_and_run()) == ((0, 0), (1, 1))
+
+
+def test_registration_pipeline_commit(tmp_path):
+    """Test waking up registrations after records are committed and failing them when commit fails."""
+    path = str(tmp_path / 'patients.db')
+    storage = SQLiteStorage(path, commit_interval=60)
+    pipeline = RegistrationPipeline(storage, PatientIndex(), PatientStats())
+    other = SQLiteStorage(path, commit_interval=60)
+
+    async def register(name: str):
+        patient, = await pipeline.submit([Patient(name=name, surname='Nowak', vaccination_date=date.today())])
+        return patient.id
+
+    patient_id = get_event_loop().run_until_complete(register('Jan'))
+    committed = sqlite3.connect(path).execute('SELECT id, name FROM patients').fetchall()
+    other.append(Patient(name='Anna', surname='Nowak', id=2, vaccination_date=date.today()))
+    other.flush()
+    with pytest.raises(sqlite3.IntegrityError):
+        get_event_loop().run_until_complete(register('Ewa'))
+
+    assert patient_id == 1
+    assert committed == [(1, 'Jan')]
+    assert len(storage) == 1 and storage.pending == []
+    assert len(pipeline.stats) == 1
+    assert list(pipeline.index.search(name='ewa')[0]) == []
+    storage.close()
+    other.close()
+
+
+def test_day_counter():
+    """Test range sums of day counts after tree is rebuilt to cover earlier and later days."""
+    today = date.today()
+    counter = DayCounter(size=2)
+    counts = {today: 3, today + timedelta(days=5): 2, today - timedelta(days=7): 1, today + timedelta(days=40): 4}
+    for day, count in counts.items():
+        counter.add(day, count)
+
+    for first in range(-10, 45, 3):
+        for last in range(first, 45, 4):
+            first_day, last_day = today + timedelta(days=first), today + timedelta(days=last)
+            assert counter.sum(first_day, last_day) == sum(count for day, count in counts.items()
+                                                           if first_day <= day <= last_day)
+    assert counter.sum() == counter.total == 10
+    assert counter.sum(last=today) == 4
+    assert counter.get(today + timedelta(days=5)) == 2
+
+
+def test_prebuilt_openapi(client, tmp_path):
+    """Test serving OpenAPI schema built with openapi.py script."""
+    path = tmp_path / 'openapi.json'
+    build_openapi(app, str(path))
+    app.openapi_schema = None
+    openapi = prebuilt_openapi(app, str(path))
+
+    assert openapi() == loads(path.read_text()) == client.get('/openapi.json').json()
+    assert openapi() is app.openapi_schema
+    assert '/stats' in app.openapi_schema['paths']
+
+
 def test_register(client, patient_payloads):
     """Test adding patient records in '/register' endpoint."""
     test_path = '/register'
@@ -106,6 +432,306 @@ def test_patient(client, patient_payloads):
         assert response.status_code == code
 
 
+def test_iter_json_records_max_size():
+    """Test skipping NDJSON lines longer than maximum record size when they are split between chunks."""
+    async def chunks():
+        for chunk in [b'{"a": 1}\n{"b": "', b'x' * 30, b'x' * 30, b'"}\n{"c"', b': 3}\n', b'{"d": "' + b'y' * 30]:
+            yield chunk
+
+    async def parse():
+        return [item async for item in iter_json_records(chunks(), max_record_size=20)]
+
+    records = get_event_loop().run_until_complete(parse())
+
+    assert records == [(0, {'a': 1}, None), (1, None, 'Record larger than 20 characters'), (2, {'c': 3}, None),
+                       (3, None, 'Record larger than 20 characters')]
+
+
+def test_register_batch(client, patient_payloads):
+    """Test streamed registration of NDJSON and JSON array records in '/register/batch' endpoint."""
+    test_path = '/register/batch'
+    payloads = patient_payloads['patients']
+    ndjson = '\n'.join([dumps(payloads[0]), '{"name": "Jan"', dumps(payloads[1]), '{"name": 1}', ''])
+    array = dumps(payloads[2:])
+
+    response_ndjson = client.post(test_path, data=ndjson)
+    response_array = client.post(test_path, data=(array[i:i + 7] for i in range(0, len(array), 7)))
+    results_ndjson = [loads(line) for line in response_ndjson.text.splitlines()]
+    results_array = [loads(line) for line in response_array.text.splitlines()]
+
+    assert response_ndjson.status_code == 200
+    assert [result['index'] for result in results_ndjson] == [0, 1, 2, 3]
+    assert 'detail' in results_ndjson[1] and 'detail' in results_ndjson[3]
+    assert response_array.status_code == 200
+    assert len(results_array) == 3
+    patients = [results_ndjson[0]['patient'], results_ndjson[2]['patient']] + [r['patient'] for r in results_array]
+    for patient, payload, delay in zip(patients, payloads, patient_payloads['delays']):
+        assert patient.items() >= payload.items()
+        assert patient['vaccination_date'] == str(date.today() + timedelta(days=delay))
+        assert client.get(f'/patient/{patient["id"]}').json() == patient
+    assert [patient['id'] for patient in patients] == list(range(patients[0]['id'], patients[0]['id'] + 5))
+
+
+def test_stats(client):
+    """Test registrations and vaccinations counts in '/stats' endpoint."""
+    test_path = '/stats'
+    today = date.today()
+    patients = [client.get(f'/patient/{pid}').json() for pid in range(1, 11)]
+    last_day = today + timedelta(days=20)
+    scheduled = sum(today.isoformat() <= patient['vaccination_date'] <= last_day.isoformat() for patient in patients)
+
+    response = client.get(test_path, params={'date_from': today.isoformat(), 'date_to': last_day.isoformat(),
+                                             'daily': True})
+    response_default = client.get(test_path)
+    response_invalid = client.get(test_path, params={'date_from': last_day.isoformat(), 'date_to': today.isoformat()})
+
+    assert response.status_code == 200
+    stats = response.json()
+    assert (stats['total_patients'], stats['total_vaccinated'], stats['registrations']) == (10, 0, 10)
+    assert stats['vaccinations'] == scheduled
+    assert len(stats['days']) == 21
+    assert stats['days'][0] == {'day': today.isoformat(), 'registrations': 10,
+                                'vaccinations': sum(patient['vaccination_date'] == today.isoformat()
+                                                    for patient in patients)}
+    assert sum(day['vaccinations'] for day in stats['days']) == scheduled
+    assert response_default.json()['days'] is None
+    assert response_invalid.status_code == 400
+
+
+def test_search_patients(client):
+    """Test filtering and paging patient records in '/patients' endpoint based on data added in previous test cases."""
+    test_path = '/patients'
+    vaccination_date = str(date.today() + timedelta(days=8))
+
+    response_prefix = client.get(test_path, params={'surname': 'NOWAK', 'prefix': True})
+    response_exact = client.get(test_path, params={'surname': 'nowak'})
+    response_combined = client.get(test_path, params={'name': 'jan', 'vaccination_from': vaccination_date,
+                                                      'vaccination_to': vaccination_date})
+    response_page = client.get(test_path, params={'name': 'jan', 'limit': 2})
+    response_next_page = client.get(test_path, params={'name': 'jan', 'limit': 2,
+                                                       'after_id': response_page.json()['next_after_id']})
+    response_all = client.get(test_path, params={'limit': 3, 'after_id': 1})
+    response_invalid = client.get(test_path, params={'limit': 0})
+
+    assert response_prefix.status_code == 200
+    assert [patient['id'] for patient in response_prefix.json()['patients']] == [3, 4, 5, 8, 9, 10]
+    assert [patient['id'] for patient in response_exact.json()['patients']] == [4, 9]
+    assert [patient['id'] for patient in response_combined.json()['patients']] == [3, 5, 8, 10]
+    assert [patient['id'] for patient in response_page.json()['patients']] == [3, 5]
+    assert [patient['id'] for patient in response_next_page.json()['patients']] == [8, 10]
+    assert response_all.json()['next_after_id'] == 4
+    assert response_invalid.status_code == 422
+
+
+def test_export_patients(client):
+    """Test streaming patient records in '/patients/export' endpoint based on data added in previous test cases."""
+    test_path = '/patients/export'
+
+    response_ndjson = client.get(test_path)
+    response_csv = client.get(test_path, params={'format': 'csv', 'after_id': 8, 'limit': 1})
+    response_invalid = client.get(test_path, params={'format': 'xml'})
+    records = [loads(line) for line in response_ndjson.text.splitlines()]
+
+    assert response_ndjson.status_code == 200
+    assert response_ndjson.headers['content-type'].startswith('application/x-ndjson')
+    assert [record['id'] for record in records] == list(range(1, 11))
+    assert records[0] == client.get('/patient/1').json()
+    assert response_csv.headers['content-type'].startswith('text/csv')
+    assert response_csv.text.splitlines() == ['name,surname,id,register_date,vaccination_date',
+                                              f'Jan Stefan,Nowak,9,{date.today()},{records[8]["vaccination_date"]}']
+    assert response_invalid.status_code == 422
+
+
+def test_export_patients_disconnect():
+    """Test stopping patient export when client disconnects."""
+    sent = []
+
+    async def receive():
+        return {'type': 'http.disconnect'}
+
+    async def send(message):
+        sent.append(message)
+
+    response = export_patient_records(ExportFormatEnum.ndjson, 0, None)
+    get_event_loop().run_until_complete(response({'type': 'http'}, receive, send))
+
+    assert not any(message.get('more_body') is False for message in sent)
+
+
+def test_schedule(client):
+    """Test reading schedule and changing capacity in '/schedule' endpoints."""
+    today = date.today()
+    day = today + timedelta(days=8)
+    future_day = today + timedelta(days=1000)
+
+    response_schedule = client.get('/schedule', params={'date_from': str(today), 'date_to': str(day)})
+    response_capacity = client.put(f'/schedule/{future_day}', params={'capacity': 5})
+    response_restore = client.put(f'/schedule/{future_day}')
+    response_rebalance = client.post('/schedule/rebalance')
+    response_invalid = client.get('/schedule', params={'date_from': str(day), 'date_to': str(today)})
+
+    assert response_schedule.status_code == 200
+    assert len(response_schedule.json()) == 9
+    assert response_schedule.json()[-1] == {'day': str(day), 'load': 4, 'capacity': None}
+    assert response_capacity.json() == {'day': str(future_day), 'load': 0, 'capacity': 5}
+    assert response_restore.json()['capacity'] is None
+    assert response_rebalance.json() == {'moved': 0}
+    assert response_invalid.status_code == 400
+
+
+def test_rebalance_schedule(client):
+    """Test moving vaccinations in records, search index, schedule and stats in '/schedule/rebalance' endpoint."""
+    day = date.today() + timedelta(days=8)
+    next_day = day + timedelta(days=1)
+
+    client.put(f'/schedule/{day}', params={'capacity': 1})
+    response_rebalance = client.post('/schedule/rebalance')
+    schedule = client.get('/schedule', params={'date_from': str(day), 'date_to': str(next_day)}).json()
+    moved = client.get('/patients', params={'vaccination_from': str(next_day), 'vaccination_to': str(next_day)}).json()
+    stats = client.get('/stats', params={'date_from': str(next_day), 'date_to': str(next_day)}).json()
+    client.put(f'/schedule/{day}')
+    response_restore = client.post('/schedule/rebalance')
+
+    assert response_rebalance.json() == {'moved': 3}
+    assert [(day_load['load'], day_load['capacity']) for day_load in schedule] == [(1, 1), (3, None)]
+    assert [patient['id'] for patient in moved['patients']] == [5, 8, 10]
+    assert all(patient['vaccination_date'] == str(next_day) for patient in moved['patients'])
+    assert client.get('/patient/5').json()['vaccination_date'] == str(day)
+    assert stats['vaccinations'] == 3
+    assert response_restore.json() == {'moved': 3}
+
+
+def test_register_after_failed_request(client):
+    """Test registering patient with the next id after request failed before saving record."""
+    failing_client = TestClient(app, raise_server_exceptions=False)
+    expected_id = len(app.patients) + 1
+
+    response_failed = failing_client.post('/register', json={'name': 'a' * 3000000, 'surname': 'Nowak'})
+    response = client.post('/register', json={'name': 'Anna', 'surname': 'Nowak'})
+
+    assert response_failed.status_code == 500
+    assert response.json()['id'] == expected_id
+    assert client.get(f'/patient/{expected_id}').json() == response.json()
+    assert client.get('/patients', params={'name': 'anna'}).json()['patients'] == [response.json()]
+
+
+def test_scheduler():
+    """Test assigning patients to the earliest days with free capacity and rebalancing them."""
+    today = date.today()
+    days = [today + timedelta(days=offset) for offset in range(4)]
+    scheduler = Scheduler(default_capacity=2)
+    scheduler.set_capacity(days[1], 0)
+
+    assigned = [scheduler.assign(days[0]) for _ in range(5)]
+    scheduler.set_capacity(days[1], 3)
+    moved = scheduler.rebalance([(pid, day, days[0]) for pid, day in enumerate(assigned, 1)], today)
+
+    assert assigned == [days[0], days[0], days[2], days[2], days[3]]
+    assert moved == [(3, days[1]), (4, days[1]), (5, days[1])]
+    assert scheduler.report(days[0], days[3]) == [(days[0], 2, 2), (days[1], 3, 3), (days[2], 0, 2),
+                                                  (days[3], 0, 2)]
+
+
+def test_memory_storage():
+    """Test saving, updating and reading patient records in compact in-memory table."""
+    patients = [Patient(name=name, surname='Nowak', id=pid, vaccination_date=date.today() + timedelta(days=pid))
+                for pid, name in enumerate(['Jan', 'Anna', 'Jan'], 1)]
+
+    storage = MemoryStorage()
+    storage.append(patients[0])
+    storage.extend(patients[1:])
+    moved = patients[1].copy(update={'vaccination_date': date.today()})
+    storage.update([moved])
+
+    assert len(storage) == 3
+    assert len(storage.strings) == 3
+    assert [storage.get(pid) for pid in range(1, 4)] == [patients[0], moved, patients[2]]
+    assert [patient.id for patient in storage.scan(after_id=1)] == [2, 3]
+    assert storage.get(0) is None
+    assert storage.get(4) is None
+
+
+def test_memory_storage_concurrent_read():
+    """Test reading the last record on another thread while records are saved."""
+    storage = MemoryStorage()
+    patients = [Patient(name='Jan', surname='Nowak', id=pid, vaccination_date=date.today()) for pid in range(1, 101)]
+    done = Event()
+    errors = []
+
+    def read():
+        while not done.is_set():
+            try:
+                storage.get(len(storage))
+            except IndexError as error:
+                errors.append(error)
+
+    switch_interval = getswitchinterval()
+    setswitchinterval(1e-6)
+    reader = Thread(target=read)
+    reader.start()
+    try:
+        for _ in range(100):
+            storage.extend(patients)
+    finally:
+        done.set()
+        reader.join()
+        setswitchinterval(switch_interval)
+
+    assert errors == []
+
+
+def test_sqlite_storage(tmp_path):
+    """Test saving and reading patient records in SQLite storage before and after commit."""
+    path = str(tmp_path / 'patients.db')
+    patients = [Patient(name='Jan', surname='Nowak', id=pid, vaccination_date=date.today()) for pid in range(1, 4)]
+
+    storage = SQLiteStorage(path, commit_interval=60)
+    storage.append(patients[0])
+    storage.extend(patients[1:])
+    pending = [storage.get(pid) for pid in range(1, 4)]
+    storage.close()
+    storage = SQLiteStorage(path, commit_interval=60)
+    storage.append(Patient(name='Anna', surname='Nowak', id=4, vaccination_date=date.today()))
+    committed = [storage.get(pid) for pid in range(1, 4)]
+    scanned = list(storage.scan(after_id=1, chunk_size=1))
+
+    assert len(storage) == 4
+    assert pending == patients
+    assert committed == patients
+    assert [patient.id for patient in scanned] == [2, 3, 4]
+    assert storage.get(5) is None
+    storage.close()
+
+
+def test_sqlite_storage_commit_error(tmp_path):
+    """Test keeping flusher thread running, retrying commits after transient errors and dropping records which can't
+    be inserted."""
+    path = str(tmp_path / 'patients.db')
+    first = SQLiteStorage(path, commit_interval=0.01)
+    first.connection.execute('PRAGMA busy_timeout = 0')
+    second = SQLiteStorage(path, commit_interval=60)
+    second.append(Patient(name='Anna', surname='Nowak', id=1, vaccination_date=date.today()))
+    second.flush()
+    first.append(Patient(name='Jan', surname='Nowak', id=1, vaccination_date=date.today()))
+    sleep(0.1)
+    dropped = len(first), len(first.pending)
+    lock = sqlite3.connect(path, isolation_level=None)
+    lock.execute('BEGIN EXCLUSIVE')
+    first.append(Patient(name='Jan', surname='Nowak', id=2, vaccination_date=date.today()))
+    sleep(0.1)
+    locked = len(first.pending)
+    lock.execute('COMMIT')
+    sleep(0.1)
+
+    assert first.flusher.is_alive()
+    assert dropped == (0, 0)
+    assert locked == 1
+    assert first.pending == [] and first.committed == 1
+    first.close()
+    second.close()
+    lock.close()
+
+
 def test_html(client):
     """Test endpoint '/hello' with simple HTML response."""
     test_path = '/hello'
@@ -124,6 +750,25 @@ def credentials():
     return environ['USER_LOGIN'], environ['USER_PASSWORD']
 
 
+def test_conditional_responses(client, credentials):
+    """Test entity tags and 304 responses of cached '/', '/hello', '/welcome_token' and '/logged_out' endpoints."""
+    token = client.post('/login_token', auth=credentials).json()['token']
+    requests = [('/', {}), ('/hello', {}), ('/welcome_token', {'token': token, 'format': 'json'}),
+                ('/logged_out', {'format': 'html'})]
+
+    for path, params in requests:
+        response = client.get(path, params=params)
+        response_cached = client.get(path, params=params, headers={'If-None-Match': response.headers['etag']})
+        response_changed = client.get(path, params=params, headers={'If-None-Match': '"other"'})
+
+        assert response.status_code == 200
+        assert response.headers['cache-control']
+        assert response_cached.status_code == 304
+        assert response_cached.content == b''
+        assert response_changed.status_code == 200
+        assert response_changed.content == response.content
+
+
 def test_login_session(client, credentials):
     """Test session receiving in '/login_session' endpoint."""
     test_path = '/login_session'
@@ -286,3 +931,152 @@ def test_multiple_login(client, credentials):
         assert response.status_code == 200
     for response in responses_token[1:]:
         assert response.status_code == 200
+
+
+def test_sqlite_key_store(tmp_path):
+    """Tests sharing keys between SQLite key stores opened by different workers."""
+    path = str(tmp_path / 'keys.db')
+    worker_stores = [SQLiteKeyStore(path, 'token'), SQLiteKeyStore(path, 'token')]
+    session_store = SQLiteKeyStore(path, 'session')
+
+    for key in ['a', 'b', 'c', 'd']:
+        worker_stores[0].append(key)
+    worker_stores[1].remove('c')
+
+    assert 'a' not in worker_stores[1]
+    assert 'b' in worker_stores[1] and 'd' in worker_stores[1]
+    assert 'c' not in worker_stores[0]
+    assert 'b' not in session_store
+
+
+def test_sqlite_key_store_capacity_and_ttl(tmp_path, monkeypatch):
+    """Test configured capacity and sliding expiration of keys in SQLite key store."""
+    now = [1000.0]
+    monkeypatch.setattr(keystore, 'time', lambda: now[0])
+    monkeypatch.setenv('KEY_STORE', 'sqlite')
+    monkeypatch.setenv('KEY_STORE_PATH', str(tmp_path / 'keys.db'))
+    monkeypatch.setenv('SESSION_CAPACITY', '4')
+    monkeypatch.setenv('SESSION_TTL', '60')
+    store = create_key_store('token')
+    for key in ['a', 'b', 'c', 'd', 'e']:
+        store.append(key)
+
+    assert 'a' not in store
+    now[0] += 50
+    assert 'b' in store
+    now[0] += 50
+    assert 'b' in store
+    assert 'c' not in store and 'e' not in store
+    assert store.connection.execute('SELECT key FROM login_keys').fetchall() == [('b',), ('d',)]
+
+
+def test_signed_key_store():
+    """Tests validation and revocation of stateless signed keys."""
+    store = SignedKeyStore('token', b'secret')
+    keys = [store.create() for _ in range(4)]
+    nonce, expires, signature = keys[1].split('.')
+    forged = [f'{nonce}.{int(expires) + 1}.{signature}', f'{nonce}.{expires}.{signature[::-1]}', 'invalid', '',
+              'é.1.é', f'{nonce}.{expires}.ż']
+    expired = SignedKeyStore('token', b'secret', ttl=-1).create()
+    other_kind = SignedKeyStore('session', b'secret').create()
+
+    store.remove(keys[0])
+
+    assert keys[0] not in store
+    for key in keys[1:]:
+        assert key in store
+    for key in forged + [expired, other_kind]:
+        assert key not in store
+
+
+def test_shared_signed_key_store(tmp_path, monkeypatch):
+    """Tests revoking stateless keys in all workers through deny list in SQLite file."""
+    monkeypatch.setenv('AUTH_MODE', 'stateless')
+    monkeypatch.setenv('SECRET_KEY', 'secret')
+    monkeypatch.setenv('KEY_STORE', 'sqlite')
+    monkeypatch.setenv('KEY_STORE_PATH', str(tmp_path / 'keys.db'))
+    worker_stores = [create_key_store('token'), create_key_store('token')]
+    keys = [worker_stores[0].create() for _ in range(2)]
+    expired = SignedKeyStore('token', b'secret', ttl=-10).create()
+
+    get_event_loop().run_until_complete(worker_stores[1].remove_async(keys[0]))
+    worker_stores[1].deny_list.add(expired.split('.')[0], int(expired.split('.')[1]))
+
+    assert not get_event_loop().run_until_complete(worker_stores[0].contains_async(keys[0]))
+    assert keys[1] in worker_stores[0]
+    assert worker_stores[0].deny_list.connection.execute('SELECT COUNT(*) FROM revoked_keys').fetchone() == (1,)
+
+
+def test_stateless_key_store_requires_secret(monkeypatch):
+    """Tests refusing to create stateless key store without shared secret."""
+    monkeypatch.setenv('AUTH_MODE', 'stateless')
+    monkeypatch.delenv('SECRET_KEY', raising=False)
+
+    with pytest.raises(ValueError):
+        create_key_store('token')
+    monkeypatch.setenv('SECRET_KEY', 'secret')
+    assert isinstance(create_key_store('token'), SignedKeyStore)
+
+
+def test_session_cache():
+    """Tests LRU eviction, expiry and counters of session cache."""
+    cache = SessionCache(capacity=2)
+    expiring_cache = SessionCache(capacity=2, ttl=0.01)
+
+    cache.append('a')
+    cache.append('b')
+    assert 'a' in cache
+    cache.append('c')
+    cache.remove('c')
+    expiring_cache.append('a')
+    expiring_cache.append('b')
+    sleep(0.02)
+    assert 'a' not in expiring_cache
+    expiring_cache.sweep()
+
+    assert 'a' in cache and 'b' not in cache and 'c' not in cache
+    assert cache.stats() == {'size': 1, 'capacity': 2, 'hits': 2, 'misses': 2, 'evictions': 1, 'expirations': 0}
+    assert len(expiring_cache) == 0 and expiring_cache.expirations == 2
+
+
+def test_metrics(client, credentials):
+    """Test request and domain metrics in '/metrics' endpoint."""
+    client.get('/patient/1')
+    client.get('/patient/2')
+    client.get('/not_existing')
+    client.post('/login_token', auth=('admin', '123456'))
+
+    response = client.get('/metrics')
+
+    assert response.status_code == 200
+    assert response.headers['content-type'].startswith('text/plain')
+    lines = response.text.splitlines()
+    patient_requests = [line for line in lines
+                        if line.startswith('http_requests_total{method="GET",route="/patient/{id}",status="2xx"}')]
+    assert len(patient_requests) == 1 and int(patient_requests[0].split()[-1]) >= 2
+    assert any(line.startswith('http_requests_total{method="GET",route="<unmatched>",status="4xx"}') for line in lines)
+    assert any(line.startswith('http_request_duration_seconds_bucket{method="GET",route="/patient/{id}",le="+Inf"}')
+               for line in lines)
+    assert any(line.startswith('patient_registrations_total ') for line in lines)
+    assert any(line.startswith('login_attempts_total{kind="token",result="failure"}') for line in lines)
+    assert any(line.startswith('session_cache_evictions_total{kind="session"}') for line in lines)
+
+
+def test_logging(monkeypatch):
+    """Tests JSON records written by background logging thread with redaction, sampling and rate limiting."""
+    monkeypatch.setenv('LOG_SAMPLE_RATES', 'sampled=0')
+    monkeypatch.setenv('LOG_RATE_LIMIT', '2')
+    logger, stream = getLogger('test_logging'), StringIO()
+    listener = setup_logging(logger, stream)
+
+    logger.info('login_request', extra={'username': 'admin', 'password': 'secret'})
+    logger.info('sampled')
+    for number in range(5):
+        logger.info('limited %d', number)
+    logger.debug('hidden')
+    listener.stop()
+    records = [loads(line) for line in stream.getvalue().splitlines()]
+
+    assert records[0]['event'] == 'login_request' and records[0]['level'] == 'INFO'
+    assert records[0]['username'] == 'admin' and records[0]['password'] == '[REDACTED]'
+    assert [record['event'] for record in records[1:]] == ['limited 0', 'limited 1']
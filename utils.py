@@ -1,34 +1,191 @@
-from fastapi import HTTPException, status
+from fastapi import HTTPException, Request, Response, status
 from fastapi.security import HTTPBasicCredentials
-from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse
+from fastapi.responses import StreamingResponse
+from codecs import getincrementaldecoder
+from functools import lru_cache
+from hashlib import blake2b
+from io import StringIO
+from itertools import islice
+from json import JSONDecoder, JSONDecodeError, dumps, loads
 from logging import getLogger
-from secrets import compare_digest, token_hex
-from os import environ
+from secrets import token_hex
+from typing import NamedTuple
 
-from models import FormatEnum
+from models import FormatEnum, ExportFormatEnum
 
+PATIENT_FIELDS = ('name', 'surname', 'id', 'register_date', 'vaccination_date')
+NDJSON_PATIENT = '{{"name":{},"surname":{},"id":{},"register_date":"{}","vaccination_date":"{}"}}\n'
 
-logger = getLogger('uvicorn')
 
+logger = getLogger('vaccinate')
 
-def check_credentials(credentials: HTTPBasicCredentials):
-    """Raises exception if given credentials not match (resistant to time attacks)."""
-    correct_username = compare_digest(credentials.username, environ['USER_LOGIN'])
-    correct_password = compare_digest(credentials.password, environ['USER_PASSWORD'])
-    if not correct_username or not correct_password:
+
+async def check_credentials(credentials: HTTPBasicCredentials, credential_store):
+    """Raises exception if given credentials not match user saved in credential store (resistant to time attacks)."""
+    if not await credential_store.verify(credentials.username, credentials.password):
         raise HTTPException(status.HTTP_401_UNAUTHORIZED)
 
 
+def count_letters(text: str) -> int:
+    """Return number of alphabetic characters in given text."""
+    return sum(letter.isalpha() for letter in text)
+
+
 def create_login_key():
     """Return string with random 16-byte value."""
     return token_hex(16)
 
 
-def format_message(message: str, message_format: FormatEnum):
-    """Returns message in response based on given format."""
+class RenderedBody(NamedTuple):
+    """Pre-encoded response body with its media type and entity tag."""
+    body: bytes
+    media_type: str
+    etag: str
+
+
+@lru_cache(maxsize=1024)
+def render_body(content: str, media_type: str) -> RenderedBody:
+    """Return encoded content with entity tag (cached)."""
+    body = content.encode('utf-8')
+    return RenderedBody(body, media_type, f'"{blake2b(body, digest_size=8).hexdigest()}"')
+
+
+@lru_cache(maxsize=256)
+def render_message(message: str, message_format: FormatEnum) -> RenderedBody:
+    """Return message rendered in given format (cached)."""
     if message_format.value == 'json':
-        return JSONResponse({'message': f'{message}'})
+        return render_body(dumps({'message': message}, ensure_ascii=False, separators=(',', ':')), 'application/json')
     elif message_format.value == 'html':
-        return HTMLResponse(f'<html><body><h1>{message}</h1></body></html>')
+        return render_body(f'<html><body><h1>{message}</h1></body></html>', 'text/html')
+
+    return render_body(message, 'text/plain')
+
+
+def cached_response(rendered: RenderedBody, request: Request = None, cache_control: str = 'no-cache'):
+    """Returns response with pre-rendered body or empty 304 response if request's If-None-Match header contains its
+    entity tag."""
+    headers = {'etag': rendered.etag, 'cache-control': cache_control}
+    if request is not None and 'if-none-match' in request.headers:
+        etags = [etag.strip() for etag in request.headers['if-none-match'].split(',')]
+        if rendered.etag in etags or '*' in etags:
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    return Response(rendered.body, media_type=rendered.media_type, headers=headers)
+
+
+def format_message(message: str, message_format: FormatEnum, request: Request = None,
+                   cache_control: str = 'private, no-cache'):
+    """Returns message in response based on given format."""
+    return cached_response(render_message(message, message_format), request, cache_control)
+
+
+class NDJSONResponse(StreamingResponse):
+    """Streaming response with newline delimited JSON. Doesn't listen for client disconnect so the body generator can
+    still consume request stream - it is used only for batch registration, other streams stop on disconnect."""
+    media_type = 'application/x-ndjson'
+
+    async def __call__(self, scope, receive, send):
+        await self.stream_response(send)
+        if self.background is not None:
+            await self.background()
+
+
+async def iter_json_records(chunks, max_record_size: int = 1 << 20):
+    """Yields (index, record, error) tuples parsed from NDJSON or JSON array body streamed in byte chunks. Invalid
+    NDJSON lines and lines longer than max_record_size are reported and skipped, invalid JSON array ends parsing."""
+    utf8 = getincrementaldecoder('utf-8')()
+    decoder = JSONDecoder()
+    buffer, array_mode, index = '', None, 0
+    line_parts, line_size, oversized = [], 0, False
+    async for chunk in chunks:
+        text = utf8.decode(chunk)
+        if array_mode is None:
+            buffer = (buffer + text).lstrip()
+            if not buffer:
+                continue
+            array_mode = buffer[0] == '['
+            if array_mode:
+                buffer = buffer[1:]
+            else:
+                text, buffer = buffer, ''
+        elif array_mode:
+            buffer += text
+
+        if not array_mode:
+            # only new text is split, unterminated line is kept in parts up to max_record_size
+            *lines, rest = text.split('\n')
+            if lines:
+                if oversized:
+                    yield index, None, f'Record larger than {max_record_size} characters'
+                    index += 1
+                else:
+                    lines[0] = ''.join(line_parts) + lines[0]
+                for line in islice(lines, 1 if oversized else 0, None):
+                    if line.strip():
+                        yield (index, *_load_line(line, max_record_size))
+                        index += 1
+                line_parts, line_size, oversized = [], 0, False
+            if not oversized:
+                line_parts.append(rest)
+                line_size += len(rest)
+                if line_size > max_record_size:
+                    line_parts, line_size, oversized = [], 0, True
+            continue
+
+        position, size = 0, len(buffer)
+        while True:
+            while position < size and buffer[position] in ' \t\r\n,':
+                position += 1
+            if position == size or buffer[position] == ']':
+                break
+            try:
+                record, position = decoder.raw_decode(buffer, position)
+            except JSONDecodeError as exc:
+                if size - position > max_record_size:
+                    yield index, None, f'Invalid JSON array: {exc}'
+                    return
+                break
+            yield index, record, None
+            index += 1
+        buffer = buffer[position:]
+
+    tail = utf8.decode(b'', final=True)
+    if array_mode:
+        if (buffer + tail).strip() not in ('', ']'):
+            yield index, None, 'Invalid JSON array: unexpected end of data'
+    elif oversized:
+        yield index, None, f'Record larger than {max_record_size} characters'
+    else:
+        line = ''.join(line_parts) + tail
+        if line.strip():
+            yield (index, *_load_line(line, max_record_size))
+
+
+def _load_line(line: str, max_record_size: int):
+    """Returns (record, error) pair parsed from single NDJSON line."""
+    if len(line) > max_record_size:
+        return None, f'Record larger than {max_record_size} characters'
+    try:
+        return loads(line), None
+    except JSONDecodeError as exc:
+        return None, f'Invalid JSON: {exc}'
+
 
-    return PlainTextResponse(f'{message}')
+def export_patients(patients, export_format: ExportFormatEnum, chunk_size: int = 1000):
+    """Yields patient records serialized in given format in chunks of chunk_size records."""
+    patients = iter(patients)
+    if export_format == ExportFormatEnum.csv:
+        from csv import writer
+        yield ','.join(PATIENT_FIELDS) + '\r\n'
+    while True:
+        chunk = list(islice(patients, chunk_size))
+        if not chunk:
+            return
+        if export_format == ExportFormatEnum.csv:
+            buffer = StringIO()
+            writer(buffer).writerows((patient.name, patient.surname, patient.id, patient.register_date,
+                                      patient.vaccination_date) for patient in chunk)
+            yield buffer.getvalue()
+        else:
+            yield ''.join(NDJSON_PATIENT.format(dumps(patient.name), dumps(patient.surname), patient.id,
+                                                patient.register_date, patient.vaccination_date) for patient in chunk)